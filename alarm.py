@@ -1,12 +1,46 @@
 # this is the main alarm logic file. it handles everything triggered by the alarm clock
 # it saves and loads alarm settings from disk as json to persist setting in case of a power loss
+# the next alarm, sunrise start, snooze end and grace period end are precomputed as timestamps whenever the
+# settings change, so the main loop only compares against them instead of rebuilding datetimes all the time
+# several alarms can exist, AlarmSet keeps them in one settings file and in a heap ordered by next deadline
+# saves are write-behind: edits are batched and written atomically a moment later (see storage.py), changes that
+# matter for whether the alarm rings (on/off, snooze, dismiss, leaving an edit screen) are flushed right away
 
+import heapq
+import itertools
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta
+
+from storage import DebouncedWriter
+
+SETTINGS_FILE = "/data/app/alarm_settings.json"
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# recurrence choices offered in the menu, an empty list means every day
+DAY_PRESETS = [("Every day", []), ("Weekdays", [0, 1, 2, 3, 4]), ("Weekends", [5, 6])] + \
+              [(name, [i]) for i, name in enumerate(DAY_NAMES)]
+
+GRACE_SECONDS  = 60    # no re-trigger for this long after the alarm was dismissed
+MISSED_SECONDS = 300   # a due alarm still rings this late (slow render, user in a menu), after that it is skipped
+
+def _local_timestamp(day, hour, minute):
+    # isdst=-1 lets libc pick the utc offset for that day, so the alarm stays at its wall-clock time across DST
+    return time.mktime((day.year, day.month, day.day, hour, minute, 0, 0, 0, -1))
+
+def _timestamp(now):
+    if now is None:
+        return time.time()
+    if isinstance(now, datetime):
+        return now.timestamp()
+    return now
 
 class Alarm:
-    def __init__(self):
+    def __init__(self, data=None, store=None):
+        self.id    = 0
+        self.store = store   # AlarmSet this alarm belongs to, save() goes through it
+
         # basic time/snooze fields
         self.hour = 7
         self.minute = 30
@@ -25,9 +59,21 @@ class Alarm:
         self.sunrise_enabled = False
         self.sunrise_minutes = 15
 
+        # recurrence, weekday numbers (0 = Monday). empty means every day
+        self.weekdays = []
 
-        # load everything (including playlist) from disk
-        self.load()
+        # precomputed deadlines (time.time() timestamps or None), see _reschedule()
+        self.next_occurrence = None   # next hour:minute, whether enabled or not
+        self.next_alarm      = None
+        self.next_sunrise    = None
+        self.snooze_end      = None
+        self.grace_end       = None
+        self.last_fired      = None   # occurrence that already rang, never picked again
+        self._sunrise_for    = None   # occurrence the sunrise was last started for
+
+        if data:
+            self.from_dict(data)
+        self._reschedule()
 
     def set_time(self, hour, minute):
         self.hour = hour
@@ -37,71 +83,157 @@ class Alarm:
 
     def enable(self):
         self.enabled = True
-        self.snooze_until = None
-        self.save()
+        self.snooze_until   = None
+        self.just_dismissed = None
+        self.save(flush=True)
 
     def disable(self):
         self.enabled = False
-        self.snooze_until = None
-        self.save()
+        self.snooze_until   = None
+        self.just_dismissed = None
+        self.save(flush=True)
 
     def toggle(self):
         self.enabled = not self.enabled
-        self.snooze_until = None
-        self.save()
+        self.snooze_until   = None
+        self.just_dismissed = None
+        self.save(flush=True)
 
     def snooze(self):
         self.snooze_until = datetime.now() + timedelta(minutes=self.snooze_minutes)
-        self.save()
+        self.save(flush=True)
+
+    def dismiss(self):
+        # alarm switched off with the snooze button, blocks re-triggering for the grace period
+        self.snooze_until   = None
+        self.just_dismissed = datetime.now()
+        self.save(flush=True)
 
     def is_snoozed(self):
         return self.snooze_until is not None and datetime.now() < self.snooze_until
 
+    # --- precomputed deadlines -----------------------------------------------
+
+    def _next_occurrence_after(self, now_ts):
+        # the current minute still counts, like the old hour/minute match did
+        day = date.fromtimestamp(now_ts)
+        for _ in range(9):   # a full week, plus a spare day in case a DST gap moved the time
+            if not self.weekdays or day.weekday() in self.weekdays:
+                ts = _local_timestamp(day, self.hour, self.minute)
+                if ts + 60 > now_ts and (self.last_fired is None or ts > self.last_fired):
+                    return ts
+            day += timedelta(days=1)
+        return None
+
+    def _reschedule(self, now_ts=None):
+        # called whenever settings change, everything else just compares against these
+        now_ts = _timestamp(now_ts)
+        self.next_occurrence = self._next_occurrence_after(now_ts)
+        self.next_alarm = self.next_occurrence if self.enabled else None
+        if self.sunrise_enabled and self.next_occurrence is not None:
+            self.next_sunrise = self.next_occurrence - self.sunrise_minutes * 60
+        else:
+            self.next_sunrise = None
+        # a switched off alarm has nothing left to ring, its snooze is no deadline either
+        self.snooze_end = self.snooze_until.timestamp() if self.snooze_until and self.enabled else None
+        self.grace_end  = self.just_dismissed.timestamp() + GRACE_SECONDS if self.just_dismissed else None
+
+    def _roll(self, now_ts):
+        # move on to the next day once an occurrence is too old to still ring
+        if self.next_occurrence is not None and now_ts >= self.next_occurrence + MISSED_SECONDS:
+            self._reschedule(now_ts)
+        # a grace period that ran out is not a deadline anymore, whether or not the alarm is enabled
+        if self.grace_end is not None and now_ts >= self.grace_end:
+            self.just_dismissed = None
+            self.grace_end = None
+
+    def next_deadline(self, now=None):
+        """Earliest timestamp at which should_trigger() or should_start_sunrise() can change, or None."""
+        self._roll(_timestamp(now))
+        candidates = [self.next_alarm, self.snooze_end, self.grace_end]
+        if self._sunrise_for != self.next_occurrence:
+            candidates.append(self.next_sunrise)
+        candidates = [c for c in candidates if c is not None]
+        return min(candidates) if candidates else None
+
+    def is_due(self, now=None):
+        now_ts = _timestamp(now)
+        deadline = self.next_deadline(now_ts)
+        return deadline is not None and now_ts >= deadline
+
     def should_start_sunrise(self, now=None):
-        if not self.sunrise_enabled:
+        now_ts = _timestamp(now)
+        self._roll(now_ts)
+        if self.next_sunrise is None or self._sunrise_for == self.next_occurrence:
             return False
-        now = now or datetime.now()
-        target_time = datetime(now.year, now.month, now.day, self.hour, self.minute)
-        sunrise_effect = target_time - timedelta(minutes=self.sunrise_minutes)
+        # started late (render blocked, settings changed) still runs for whatever time is left
+        return self.next_sunrise <= now_ts < self.next_occurrence
 
-        # Check if we're exactly at the start minute
-        window = timedelta(seconds = 2)
-        return sunrise_effect <= now < (sunrise_effect + window)
+    def sunrise_started(self, now=None):
+        # mark this occurrence's sunrise as running and return the seconds left until the alarm
+        self._sunrise_for = self.next_occurrence
+        return max(0, self.next_occurrence - _timestamp(now))
 
-    def should_trigger(self):
-        now = datetime.now()
+    def should_trigger(self, now=None):
+        now_ts = _timestamp(now)
         if not self.enabled:
             return False
-        if self.is_snoozed():
-            return False
-        
-        #prevent re-trigger when disarmed
-        if hasattr(self, "just_dismissed") and self.just_dismissed:
-            if (now - self.just_dismissed).total_seconds() < 60:
-                return False
-            else:
-                self.just_dismissed = None  # Reset after grace period
 
         # If snooze period has just ended, trigger now
-        if self.snooze_until is not None and now >= self.snooze_until:
+        if self.snooze_end is not None:
+            if now_ts < self.snooze_end:
+                return False
             self.snooze_until = None
-            self.save()
+            self.save(flush=True)
             return True
-        # Normal alarm time match
-        return now.hour == self.hour and now.minute == self.minute
+
+        #prevent re-trigger when disarmed
+        if self.grace_end is not None:
+            if now_ts < self.grace_end:
+                return False
+            self.just_dismissed = None  # Reset after grace period
+            self.grace_end = None
+
+        # Normal alarm time
+        self._roll(now_ts)
+        return self.next_alarm is not None and now_ts >= self.next_alarm
 
     def alarm_triggered(self):
+        # the occurrence that just rang is used up, the next one is tomorrow
+        if self.next_alarm is not None and self.next_alarm <= time.time():
+            self.last_fired = self.next_alarm
         self.snooze_until = None
+        self.save(flush=True)
+
+    def set_weekdays(self, weekdays):
+        self.weekdays = sorted(set(weekdays))
         self.save()
 
     def time_str(self):
         return f"{self.hour:02}:{self.minute:02}"
 
-    def save(self, filename="/data/app/alarm_settings.json"):
-        data = {
+    def days_str(self):
+        for label, days in DAY_PRESETS:
+            if days == self.weekdays:
+                return label
+        if len(self.weekdays) == 7:
+            return "Every day"
+        return ", ".join(DAY_NAMES[d] for d in self.weekdays)
+
+    def save(self, flush=False):
+        # every settings change ends up here, so this is where the deadlines get recomputed
+        # flush=True writes to disk right away instead of batching with the next edits
+        self._reschedule()
+        if self.store is not None:
+            self.store.changed(self, flush)
+
+    def to_dict(self):
+        return {
+            "id":              self.id,
             "hour":            self.hour,
             "minute":          self.minute,
             "enabled":         self.enabled,
+            "weekdays":        self.weekdays,
             "snooze_minutes":  self.snooze_minutes,
             "snooze_until":    self.snooze_until.isoformat() if self.snooze_until else None,
             # spotify
@@ -113,38 +245,150 @@ class Alarm:
             "sunrise_minutes": self.sunrise_minutes,
 
         }
-        try:
-            with open(filename, "w") as f:
-                json.dump(data, f)
-        except Exception as e:
-            print("Failed to save alarm settings:", e)
 
-    def load(self, filename="/data/app/alarm_settings.json"):
-        if not os.path.exists(filename):
+    def from_dict(self, data):
+        self.id             = int(data.get("id", 0))
+        self.hour           = int(data.get("hour", 7))
+        self.minute         = int(data.get("minute", 30))
+        self.enabled        = bool(data.get("enabled", True))
+        self.weekdays       = sorted(int(d) for d in data.get("weekdays", []))
+        self.snooze_minutes = int(data.get("snooze_minutes", 5))
+
+        snooze_str = data.get("snooze_until")
+        if snooze_str:
+            candidate = datetime.fromisoformat(snooze_str)
+            self.snooze_until = candidate if candidate > datetime.now() else None
+        else:
+            self.snooze_until = None
+
+        # restore persisted sound
+        self.playlist_id   = data.get("playlist_id")
+        self.playlist_name = data.get("playlist_name")
+        self.sound_type = data.get("sound_type", "Classic")
+
+        #restore sunrise
+        self.sunrise_enabled = bool(data.get("sunrise_enabled", False))
+        self.sunrise_minutes = int(data.get("sunrise_minutes", 15))
+
+
+class AlarmSet:
+    """
+    All alarms, stored together in one settings file.
+    Alarms sit in a heap ordered by their next deadline (alarm, sunrise, snooze or grace end), so finding the
+    next one to act on is a look at the head. Changed alarms get a fresh entry and old entries are dropped lazily.
+    """
+
+    def __init__(self, filename=SETTINGS_FILE):
+        self.filename = filename
+        self.alarms   = []
+        self._heap    = []                # (deadline, seq, alarm)
+        self._live    = {}                # alarm id -> seq of its current heap entry
+        self._seq     = itertools.count()
+        self.writer   = DebouncedWriter(filename, self.to_dict)
+        self.load()
+        if not self.alarms:
+            self.add()
+
+    def __len__(self):
+        return len(self.alarms)
+
+    # --- collection ----------------------------------------------------------
+
+    def add(self, data=None):
+        alarm = Alarm(data, store=self)
+        alarm.id = max((a.id for a in self.alarms), default=0) + 1
+        self.alarms.append(alarm)
+        self.changed(alarm, flush=True)
+        return alarm
+
+    def remove(self, alarm):
+        self.alarms.remove(alarm)
+        self._live.pop(alarm.id, None)
+        self.save(flush=True)
+
+    def changed(self, alarm, flush=False):
+        # called by Alarm.save()
+        self._push(alarm)
+        self.save(flush)
+
+    def snoozed(self):
+        return next((a for a in self.alarms if a.is_snoozed()), None)
+
+    def any_enabled(self):
+        return any(a.enabled for a in self.alarms)
+
+    def upcoming(self):
+        # the enabled alarm that rings next, used for the icons on the clock screen
+        enabled = [a for a in self.alarms if a.next_alarm is not None]
+        return min(enabled, key=lambda a: a.next_alarm, default=None)
+
+    # --- queue ---------------------------------------------------------------
+
+    def _push(self, alarm, now=None):
+        seq = next(self._seq)
+        self._live[alarm.id] = seq
+        deadline = alarm.next_deadline(now)
+        if deadline is not None:
+            heapq.heappush(self._heap, (deadline, seq, alarm))
+
+    def peek(self, now=None):
+        """Return (deadline, alarm) for the alarm that needs attention first, or None."""
+        while self._heap:
+            deadline, seq, alarm = self._heap[0]
+            if self._live.get(alarm.id) != seq:
+                heapq.heappop(self._heap)
+                continue
+            # deadlines can also move without a save (sunrise started, grace period over, day rolled on)
+            current = alarm.next_deadline(now)
+            if current != deadline:
+                heapq.heappop(self._heap)
+                self._push(alarm, now)
+                continue
+            return deadline, alarm
+        return None
+
+    def due(self, now=None):
+        """
+        Every alarm whose deadline has passed, earliest first. A passed deadline that can't act yet (a
+        snooze ending while a menu is open) stays queued until it can, without hiding the alarms behind it.
+        """
+        now_ts = _timestamp(now)
+        found, entries = [], []
+        while True:
+            head = self.peek(now_ts)
+            if head is None or now_ts < head[0]:
+                break
+            entries.append(heapq.heappop(self._heap))
+            found.append(head[1])
+        for entry in entries:
+            heapq.heappush(self._heap, entry)
+        return found
+
+    # --- persistence ---------------------------------------------------------
+
+    def to_dict(self):
+        return {"alarms": [a.to_dict() for a in list(self.alarms)]}
+
+    def save(self, flush=False):
+        self.writer.mark_dirty()
+        if flush:
+            self.writer.flush()
+
+    def flush(self):
+        # write pending edits now, called on shutdown
+        self.writer.flush()
+
+    def load(self):
+        if not os.path.exists(self.filename):
             return
         try:
-            with open(filename, "r") as f:
+            with open(self.filename, "r") as f:
                 data = json.load(f)
-            self.hour           = int(data.get("hour", 7))
-            self.minute         = int(data.get("minute", 30))
-            self.enabled        = bool(data.get("enabled", True))
-            self.snooze_minutes = int(data.get("snooze_minutes", 5))
-
-            snooze_str = data.get("snooze_until")
-            if snooze_str:
-                candidate = datetime.fromisoformat(snooze_str)
-                self.snooze_until = candidate if candidate > datetime.now() else None
-            else:
-                self.snooze_until = None
-
-            # restore persisted sound
-            self.playlist_id   = data.get("playlist_id")
-            self.playlist_name = data.get("playlist_name")
-            self.sound_type = data.get("sound_type", "Classic")
-
-            #restore sunrise
-            self.sunrise_enabled = bool(data.get("sunrise_enabled", False))
-            self.sunrise_minutes = int(data.get("sunrise_minutes", 15))
-
+            # older versions stored a single alarm at the top level
+            records = data["alarms"] if "alarms" in data else [dict(data, id=1)]
+            for record in records:
+                alarm = Alarm(record, store=self)
+                self.alarms.append(alarm)
+                self._push(alarm)
         except Exception as e:
             print("Failed to load alarm settings:", e)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# benchmark for the track download pipeline, runs offline: every "search" resolves to a generated local
+# audio file (see fake_extractor in download_backends.py), so what is measured is yt-dlp's own overhead
+# per track - process start, imports, extractor setup - plus the wav conversion if ffmpeg is installed
+# usage: python3 bench_download.py [tracks] [workers]
+
+import concurrent.futures
+import math
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+from download_backends import BACKENDS
+
+
+def make_source(folder: Path, seconds=2, rate=22050) -> Path:
+    # a short sine tone stands in for the downloaded audio
+    path = folder / "source.wav"
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"".join(struct.pack("<h", int(8000 * math.sin(i / rate * 2 * math.pi * 440)))
+                               for i in range(seconds * rate)))
+    return path
+
+
+def bench(backend, tracks, workers, out_dir: Path):
+    def fetch_one(i):
+        return backend.download(f"Artist - Track {i} official audio", out_dir / f"Artist - Track {i}.m4a")
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        files = list(pool.map(fetch_one, range(tracks)))
+    elapsed = time.perf_counter() - start
+    assert all(f.exists() for f in files), "missing output files"
+    return elapsed
+
+
+def main():
+    tracks  = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    convert = shutil.which("ffmpeg") is not None
+    tmp = Path(tempfile.mkdtemp(prefix="bench_download-"))
+    try:
+        source = make_source(tmp)
+        print(f"tracks: {tracks}, workers: {workers}, wav conversion: {'on' if convert else 'off (no ffmpeg)'}")
+        print(f"{'backend':12} {'total s':>9} {'s/track':>9} {'instances':>10}")
+        for name in ("subprocess", "ytdlp"):
+            out_dir = tmp / name
+            out_dir.mkdir()
+            try:
+                backend = BACKENDS[name](convert=convert, fake_source=source)
+            except ImportError:
+                print(f"{name:12} yt_dlp module not installed")
+                continue
+            elapsed = bench(backend, tracks, workers, out_dir)
+            instances = getattr(backend, "instances", tracks)
+            print(f"{name:12} {elapsed:9.2f} {elapsed / tracks:9.3f} {instances:10}")
+        self_rss  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        print(f"peak rss: in-process {self_rss:.0f} MB, largest subprocess {child_rss:.0f} MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
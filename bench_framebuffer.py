@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# microbenchmark for the frame packing path, runs without the display attached
+# compares the old per-frame path (new image + rotate(180) + the driver's getbuffer loop)
+# with the new one (reused canvas + numpy packing into a preallocated buffer, see panel.py)
+# usage: python3 bench_framebuffer.py [frames]
+
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from panel import pack_frame
+
+WIDTH, HEIGHT = 480, 280          # landscape frame as drawn by final.py
+EPD_WIDTH, EPD_HEIGHT = 280, 480  # panel ram layout
+
+
+def getbuffer(image):
+    # copy of epd3in7.EPD.getbuffer for a landscape image, so this runs without the waveshare library
+    buf = [0xFF] * (int(EPD_WIDTH/8) * EPD_HEIGHT)
+    image_monocolor = image.convert('1')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    for y in range(imheight):
+        for x in range(imwidth):
+            newx = y
+            newy = EPD_HEIGHT - x - 1
+            if pixels[x, y] == 0:
+                buf[int((newx + newy*EPD_WIDTH) / 8)] &= ~(0x80 >> (y % 8))
+    return buf
+
+
+def paint(draw, font, i):
+    draw.text((40, 60), f"{i % 24:02}:{i % 60:02}", font=font, fill=0)
+    draw.rectangle((435, 20, 467, 52), fill=0)
+    draw.text((150, 230), "Sat, 17 Oct", font=font, fill=0)
+
+
+def old_frame(font, i):
+    img = Image.new('1', (WIDTH, HEIGHT), 255)
+    paint(ImageDraw.Draw(img), font, i)
+    img = img.rotate(180)
+    return getbuffer(img)
+
+
+def make_new_frame():
+    canvas = Image.new('1', (WIDTH, HEIGHT), 255)
+    draw   = ImageDraw.Draw(canvas)
+    out    = np.empty((EPD_HEIGHT, EPD_WIDTH // 8), dtype=np.uint8)
+
+    def new_frame(font, i):
+        draw.rectangle((0, 0, WIDTH, HEIGHT), fill=255)
+        paint(draw, font, i)
+        pack_frame(canvas, out)
+        return out
+    return new_frame
+
+
+def bench(fn, font, frames):
+    start = time.perf_counter()
+    for i in range(frames):
+        fn(font, i)
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    font = ImageFont.load_default()
+    new_frame = make_new_frame()
+
+    # both paths must produce the same bytes
+    assert bytes(old_frame(font, 7)) == new_frame(font, 7).tobytes(), "packed buffers differ"
+
+    old_ms = bench(old_frame, font, frames)
+    new_ms = bench(new_frame, font, frames)
+    print(f"frames:             {frames}")
+    print(f"rotate + getbuffer: {old_ms:8.3f} ms/frame")
+    print(f"canvas + numpy:     {new_ms:8.3f} ms/frame")
+    print(f"speedup:            {old_ms / new_ms:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
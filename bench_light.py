@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# benchmark for the light code, runs against the local stand-in bulbs from shelly_sim.py (no bulb needed)
+#   transports - the same brightness ramp over each transport, one command at a time:
+#                commands per second and latency percentiles
+#   scenarios  - light_control as the alarm clock uses it (sunrise in both modes, cancelling a sunrise,
+#                encoder brightness bursts, on/off toggling) against bulbs with injected latency, jitter,
+#                drops and rate limits: requests sent, drift against the requested end, cancel latency
+# usage: python3 bench_light.py [transports|scenarios|all] [--commands 500] [--bulbs 1] [--dead]
+#                               [--sunrise 20] [--transport http] [--latency 0.05 --jitter 0.02 --drop 0.02 ...]
+
+import argparse
+import threading
+import time
+
+import light_control
+import shelly_sim
+from light_transport import make_transport
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# --- transports ------------------------------------------------------------------
+
+def bench_transport(transport, commands):
+    transport.request(None)          # connect outside the measurement
+    latencies = []
+    start = time.perf_counter()
+    for i in range(commands):
+        params = {"turn": "on", "mode": "white", "temp": 3000, "brightness": 1 + i % 100}
+        t = time.perf_counter()
+        transport.request(params)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return commands / elapsed, latencies
+
+
+def run_transports(args):
+    bulb, http_addr, ws_addr = shelly_sim.start()
+    print(f"commands:  {args.commands}")
+    print(f"{'transport':10} {'cmd/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, addr in (("http", http_addr), ("ws", ws_addr)):
+        rate, latencies = bench_transport(make_transport(name, addr), args.commands)
+        print(f"{name:10} {rate:9.0f} {percentile(latencies, 50)*1000:9.3f} {percentile(latencies, 99)*1000:9.3f}")
+
+
+# --- scenarios -------------------------------------------------------------------
+
+class Rig:
+    """A light_control group pointed at simulated bulbs."""
+
+    def __init__(self, args):
+        self.bulbs = []
+        addresses = []
+        for i in range(args.bulbs):
+            bulb, http_addr, ws_addr = shelly_sim.start(faults=shelly_sim.faults_from_args(args))
+            self.bulbs.append(bulb)
+            addresses.append(http_addr if args.transport == "http" else ws_addr)
+        if args.dead:
+            # answers nothing, every request runs into the client timeout
+            _, http_addr, ws_addr = shelly_sim.start(faults=shelly_sim.Faults(drop=1.0, drop_hang=30))
+            addresses.append(http_addr if args.transport == "http" else ws_addr)
+        self.group = light_control.configure(addresses, transport=args.transport)
+        # the dead bulb's worker is busy with timeouts all the time, only the live ones can settle
+        self.live = self.group.clients[:args.bulbs]
+        self.settle()
+
+    def mark(self):
+        self._commands = [b.commands for b in self.bulbs]
+        self._logged   = [len(b.log) for b in self.bulbs]
+
+    def commands(self):
+        return sum(b.commands - n for b, n in zip(self.bulbs, self._commands))
+
+    def new_log(self):
+        return [entry for b, n in zip(self.bulbs, self._logged) for entry in b.log[n:]]
+
+    def settle(self, timeout=10):
+        start = time.monotonic()
+        for c in self.live:
+            c.wait_idle(max(0.0, start + timeout - time.monotonic()))
+        return time.monotonic() - start
+
+
+def scenario_sunrise(rig, args, mode):
+    rig.mark()
+    end = time.monotonic() + args.sunrise
+    light_control.sunrise_effect(end_at=time.time() + args.sunrise, mode=mode)
+    rig.settle()
+    log = rig.new_log()
+    # a command with a transition is only reached once the bulb's fade is over
+    reached = max(t + int(params.get("transition", 0)) / 1000 for t, params in log) if log else end
+    final = all(b.status["brightness"] == light_control.SUNRISE_END[3] for b in rig.bulbs)
+    return f"commands {rig.commands():5}   drift {reached - end:+7.3f} s   final {'ok' if final else 'WRONG'}"
+
+
+def scenario_cancel(rig, args):
+    light_control.turn_off()
+    rig.settle()
+    rig.mark()
+    cancel = threading.Event()
+    thread = light_control.run_sunrise_thread(cancel_event=cancel, end_at=time.time() + args.sunrise, mode="steps")
+    time.sleep(min(2.0, args.sunrise / 2))
+    start = time.monotonic()
+    cancel.set()
+    light_control.turn_off()
+    thread.join()
+    stopped = time.monotonic() - start
+    while any(b.status["ison"] for b in rig.bulbs) and time.monotonic() - start < 10:
+        time.sleep(0.001)
+    off = time.monotonic() - start
+    return f"commands {rig.commands():5}   sunrise stopped {stopped*1000:7.1f} ms   bulbs off {off*1000:7.1f} ms"
+
+
+def scenario_burst(rig, args, steps=100, interval=0.01):
+    # encoder turned quickly: one set_brightness every 10 ms, like the gpiozero callback
+    light_control.turn_on()
+    rig.settle()
+    rig.mark()
+    target = light_control.get_lights().gain
+    for _ in range(steps):
+        target = max(1, min(100, target + 3 if target < 97 else 1))
+        light_control.set_brightness(target)
+        time.sleep(interval)
+    settle = rig.settle()
+    final = all(b.status["brightness"] == target for b in rig.bulbs)
+    return f"commands {rig.commands():5}   of {steps} calls   settle {settle*1000:7.1f} ms   final {'ok' if final else 'WRONG'}"
+
+
+def scenario_toggle(rig, args, toggles=50, interval=0.02):
+    rig.mark()
+    for i in range(toggles):
+        (light_control.turn_on if i % 2 == 0 else light_control.turn_off)()
+        time.sleep(interval)
+    settle = rig.settle()
+    final = not any(b.status["ison"] for b in rig.bulbs)
+    return f"commands {rig.commands():5}   of {toggles} calls   settle {settle*1000:7.1f} ms   final {'ok' if final else 'WRONG'}"
+
+
+def run_scenarios(args):
+    rig = Rig(args)
+    faults = f"latency {args.latency}s, jitter {args.jitter}s, drop {args.drop}, rate limit {args.rate_limit}"
+    print(f"{args.bulbs} bulb(s){' + 1 dead' if args.dead else ''} over {args.transport}, {faults}")
+    print(f"sunrise steps      {scenario_sunrise(rig, args, 'steps')}")
+    print(f"sunrise keyframes  {scenario_sunrise(rig, args, 'transition')}")
+    print(f"sunrise cancel     {scenario_cancel(rig, args)}")
+    print(f"brightness burst   {scenario_burst(rig, args)}")
+    print(f"on/off toggling    {scenario_toggle(rig, args)}")
+    light_control.get_lights().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="light control benchmarks against shelly_sim")
+    parser.add_argument("what", nargs="?", default="all", choices=["transports", "scenarios", "all"])
+    parser.add_argument("--commands", type=int, default=500, help="commands per transport")
+    parser.add_argument("--bulbs", type=int, default=1)
+    parser.add_argument("--dead", action="store_true", help="add a bulb that never answers")
+    parser.add_argument("--sunrise", type=float, default=20, help="sunrise duration in seconds")
+    parser.add_argument("--transport", default="http", choices=["http", "ws"])
+    shelly_sim.add_fault_args(parser)
+    args = parser.parse_args()
+
+    if args.what in ("transports", "all"):
+        run_transports(args)
+    if args.what == "all":
+        print()
+    if args.what in ("scenarios", "all"):
+        run_scenarios(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# download_backends.py
+# how spotify_service turns a "artist - title" search into a .wav file
+#   ytdlp      - drives yt-dlp through its python api. YoutubeDL instances (with their http session and
+#                extractor cache) are kept in a pool and reused for every track, so the interpreter start,
+#                extractor imports and search setup are paid once instead of once per track
+#   subprocess - one yt-dlp process per track, the old way. used when the yt_dlp module isn't importable
+# only ytdlp reports byte progress while a track downloads, its progress hooks see every chunk
+# both can be pointed at a local audio file instead of youtube (fake_source), which is what
+# bench_download.py uses to measure the pipeline offline
+
+import hashlib
+import logging
+import queue
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(DownloadError):
+    pass
+
+
+def _escape_outtmpl(path: Path) -> str:
+    # outfile names come from track titles, a "%" would be read as a template field
+    return str(path).replace("%", "%%")
+
+
+def fake_extractor(source: Path):
+    """
+    Build a yt-dlp extractor for "fake:<query>" urls that resolves every query to the local audio file
+    `source`, so search, format selection, download and post-processing run without a network.
+    """
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class FakeIE(InfoExtractor):
+        IE_NAME = "fake"
+        _VALID_URL = r"fake:(?P<id>.+)"
+
+        def _real_extract(self, url):
+            query = self._match_id(url)
+            return {
+                "id": hashlib.sha1(query.encode()).hexdigest()[:11],
+                "title": query,
+                "url": source.as_uri(),
+                "ext": source.suffix.lstrip("."),
+                "vcodec": "none",
+            }
+
+    return FakeIE
+
+
+class YtDlpBackend:
+    name = "ytdlp"
+
+    def __init__(self, convert: bool = True, fake_source: Path | str = None):
+        import yt_dlp          # ImportError here makes make_backend fall back to subprocess
+        self._yt_dlp = yt_dlp
+        self.convert = convert
+        self.fake_source = Path(fake_source).resolve() if fake_source else None
+        self._idle = queue.SimpleQueue()    # YoutubeDL instances not in use right now
+        self.instances = 0
+        # progress hooks run on the downloading thread, this is where they find that download's
+        # cancel event and progress callback
+        self._local = threading.local()
+
+    def _new_instance(self):
+        opts = {
+            "format": AUDIO_FORMAT,
+            "default_search": "ytsearch1",
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+            "outtmpl": {"default": "%(title)s.%(ext)s"},
+        }
+        if self.convert:
+            opts["postprocessors"] = [{"key": "FFmpegExtractAudio", "preferredcodec": "wav"}]
+        if self.fake_source:
+            opts["enable_file_urls"] = True
+        ydl = self._yt_dlp.YoutubeDL(opts)
+        ydl.add_progress_hook(self._progress_hook)
+        if self.fake_source:
+            ydl.add_info_extractor(fake_extractor(self.fake_source)())
+        self.instances += 1
+        return ydl
+
+    @contextmanager
+    def _borrow(self):
+        # YoutubeDL isn't thread safe, every worker thread gets an instance of its own for one track
+        try:
+            ydl = self._idle.get_nowait()
+        except queue.Empty:
+            ydl = self._new_instance()
+        try:
+            yield ydl
+        finally:
+            self._idle.put(ydl)
+
+    def _progress_hook(self, d):
+        cancel = getattr(self._local, "cancel", None)
+        if cancel is not None and cancel.is_set():
+            # aborts the transfer, yt-dlp passes this one through instead of wrapping it
+            raise self._yt_dlp.utils.DownloadCancelled()
+        progress = getattr(self._local, "progress", None)
+        if progress is not None and d.get("status") in ("downloading", "finished"):
+            done = d.get("downloaded_bytes") or 0
+            progress(done, d.get("total_bytes") or d.get("total_bytes_estimate") or done)
+
+    def download(self, query: str, outfile: Path, cancel: threading.Event = None, progress=None) -> Path:
+        """
+        Download the best match for query to outfile (the extension is replaced). Returns the final file.
+        Setting `cancel` stops the transfer and raises DownloadCancelled.
+        progress(downloaded_bytes, total_bytes) is called for every chunk, from this thread.
+        """
+        with self._borrow() as ydl:
+            ydl.params["outtmpl"]["default"] = _escape_outtmpl(outfile)
+            self._local.cancel = cancel
+            self._local.progress = progress
+            try:
+                if self.fake_source:
+                    info = ydl.extract_info(f"fake:{query}", ie_key="Fake")
+                else:
+                    info = ydl.extract_info(query)
+            except self._yt_dlp.utils.DownloadCancelled as e:
+                raise DownloadCancelled("cancelled") from e
+            except self._yt_dlp.utils.DownloadError as e:
+                raise DownloadError(str(e).splitlines()[-1]) from e
+            finally:
+                self._local.cancel = None
+                self._local.progress = None
+        # search results come back as a one-entry playlist
+        if info.get("_type") == "playlist":
+            entries = [e for e in info.get("entries") or [] if e]
+            if not entries:
+                raise DownloadError("no search results")
+            info = entries[0]
+        downloads = info.get("requested_downloads") or []
+        if not downloads or not Path(downloads[0]["filepath"]).exists():
+            raise DownloadError("yt-dlp reported no output file")
+        return Path(downloads[0]["filepath"])
+
+
+class SubprocessBackend:
+    name = "subprocess"
+
+    def __init__(self, convert: bool = True, fake_source: Path | str = None):
+        self.convert = convert
+        self.fake_source = Path(fake_source).resolve() if fake_source else None
+
+    def download(self, query: str, outfile: Path, cancel: threading.Event = None, progress=None) -> Path:
+        # progress is accepted for the same signature, yt-dlp's output is only looked at when it exits
+        if self.fake_source:
+            # the yt-dlp command line can't load extra extractors, a file url gives it the same local file
+            cmd = [sys.executable, "-m", "yt_dlp", "--enable-file-urls", self.fake_source.as_uri()]
+        else:
+            cmd = ["yt-dlp", "--default-search", "ytsearch1", query]
+        cmd += ["-f", AUDIO_FORMAT, "-o", _escape_outtmpl(outfile), "--quiet", "--no-warnings"]
+        if self.convert:
+            cmd += ["-x", "--audio-format", "wav"]
+
+        # Run and capture everything—nothing will print to your console/display
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        while True:
+            try:
+                _, stderr = proc.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    proc.kill()
+                    proc.communicate()
+                    raise DownloadCancelled("cancelled") from None
+        if proc.returncode != 0:
+            lines = stderr.strip().splitlines()
+            raise DownloadError(lines[-1] if lines else f"yt-dlp exited with {proc.returncode}")
+        # -o is a plain file name, only the conversion changes its extension
+        final = outfile.with_suffix(".wav") if self.convert else outfile
+        if not final.exists():
+            raise DownloadError("yt-dlp reported no output file")
+        return final
+
+
+BACKENDS = {
+    YtDlpBackend.name:      YtDlpBackend,
+    SubprocessBackend.name: SubprocessBackend,
+}
+
+
+def make_backend(name: str = YtDlpBackend.name, **kwargs):
+    """Build the named backend, falling back to subprocess when the yt_dlp module isn't installed."""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown download backend {name!r}, choose from {sorted(BACKENDS)}") from None
+    try:
+        return backend(**kwargs)
+    except ImportError as e:
+        logger.warning(f"yt_dlp module not available ({e}), running yt-dlp as a subprocess")
+        return SubprocessBackend(**kwargs)
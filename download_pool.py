@@ -0,0 +1,172 @@
+# download_pool.py
+# runs the track downloads with a number of workers that is tuned while they run (aimd, like tcp):
+# one more worker as long as that still raises the combined throughput, back one when it doesn't,
+# and half of them at once when the pi is struggling - cpu load from the ffmpeg conversions, little free
+# memory, or the clock itself getting slow (long frames, late main loop wakeups, see Display.ui_pressure)
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 1-minute load average per core above which the pi counts as overloaded
+LOAD_LIMIT = 1.5
+# MemAvailable below this (MB) counts as overloaded, every worker can mean an ffmpeg process
+MIN_FREE_MB = 64
+# more workers must improve the combined throughput by at least this much to stay
+MIN_GAIN = 0.05
+# after a decrease wait this long before reacting to pressure again, the load average lags behind
+COOLDOWN = 10.0
+
+
+def _free_mb():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def system_pressure():
+    """Return why the system is overloaded, or None."""
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0.0
+    if load > LOAD_LIMIT:
+        return f"load {load:.1f}/core"
+    free = _free_mb()
+    if free is not None and free < MIN_FREE_MB:
+        return f"{free:.0f} MB free"
+    return None
+
+
+class AimdController:
+    """
+    Worker limit between min_workers and max_workers. record() is called with every finished item,
+    once `limit` items have finished the combined throughput of that window decides the next step.
+    pressure() returns a reason to back off (or None), ui_pressure is an extra such callable.
+    """
+
+    def __init__(self, min_workers=1, max_workers=4, start=2, ui_pressure=None):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.limit = max(min_workers, min(max_workers, start))
+        self.ui_pressure = ui_pressure
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_items = 0
+        self._last_rate = None
+        self._cooldown_until = 0.0
+        # stats
+        self.increases = 0
+        self.decreases = 0
+
+    def pressure(self):
+        if self.ui_pressure is not None:
+            reason = self.ui_pressure()
+            if reason:
+                return reason
+        return system_pressure()
+
+    def check(self):
+        """Back off right away when under pressure. Called before a worker takes the next item."""
+        now = time.monotonic()
+        if now < self._cooldown_until:
+            return
+        reason = self.pressure()
+        if reason is None:
+            return
+        with self._lock:
+            new = max(self.min_workers, self.limit // 2)
+            self._cooldown_until = now + COOLDOWN
+            if new != self.limit:
+                logger.debug(f"Download workers {self.limit} -> {new} ({reason})")
+                self.limit = new
+                self.decreases += 1
+            self._reset_window(now)
+
+    def record(self, nbytes):
+        with self._lock:
+            self._window_bytes += nbytes
+            self._window_items += 1
+            if self._window_items < self.limit:
+                return
+            now = time.monotonic()
+            rate = self._window_bytes / max(1e-6, now - self._window_start)
+            if self._last_rate is None or rate >= self._last_rate * (1 + MIN_GAIN):
+                # still scaling: additive increase, but not while recovering from pressure
+                if self.limit < self.max_workers and now >= self._cooldown_until:
+                    self.limit += 1
+                    self.increases += 1
+            elif rate < self._last_rate * (1 - MIN_GAIN) and self.limit > self.min_workers:
+                # the last added worker made things worse (link or cpu saturated)
+                self.limit -= 1
+                self.decreases += 1
+            self._last_rate = rate
+            self._reset_window(now)
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_items = 0
+
+
+def _lower_priority(nice):
+    # linux applies a nice value to the single thread given by its id, and processes the thread
+    # starts (ffmpeg) inherit it. elsewhere this is a no-op
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+
+def run_adaptive(fn, items, controller, cancel=None, nice=0):
+    """
+    Call fn(item) for every item, at most controller.limit at a time. fn returns the bytes it produced
+    (the work measure for throughput). Errors are logged and count as no work. Setting the
+    threading.Event `cancel` stops handing out items, items already running finish.
+    nice > 0 runs the workers at a lower cpu priority.
+    """
+    todo = deque(items)
+    cond = threading.Condition()
+    active = 0
+
+    def worker():
+        nonlocal active
+        if nice:
+            _lower_priority(nice)
+        while True:
+            with cond:
+                while True:
+                    if not todo or (cancel is not None and cancel.is_set()):
+                        return
+                    controller.check()
+                    if active < controller.limit:
+                        break
+                    # the limit can go up or down while waiting
+                    cond.wait(0.5)
+                item = todo.popleft()
+                active += 1
+            nbytes = 0
+            try:
+                nbytes = fn(item) or 0
+            except Exception as e:
+                logger.error(f"Download worker error: {e}")
+            controller.record(nbytes)
+            with cond:
+                active -= 1
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(controller.max_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
@@ -0,0 +1,328 @@
+# download_queue.py
+# per-track download jobs that survive a reboot, a crash or a cancel
+# every playlist being synced is an entry in <music_dir>/download_queue.json holding one job per missing track:
+#   {pid: {"name": ..., "snapshot": ..., "jobs": [{"id", "artist", "title", "state", "tries"}, ...]}}
+# "jobs" is None while the track list is still being fetched from spotify
+# job states: pending -> running -> done, or back to pending after an error until MAX_TRIES, then failed.
+# one runner thread downloads the tracks, in parallel batches through download_pool.run_adaptive.
+# the first READY_TRACKS of every playlist come first, that's enough for an alarm to play, so a playlist
+# picked late in the evening is usable after a minute. the rest of the tracks follow as a background batch
+# with fewer workers at a lower cpu priority, which a newly queued playlist's first tracks interrupt
+# progress (tracks, bytes of the downloads in flight, an eta) is read with progress(pid), `updates` tells the
+# display when it's worth reading again without waking it for every downloaded chunk
+
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from storage import atomic_write_json
+from download_pool import AimdController, run_adaptive
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE    = "done"
+FAILED  = "failed"
+
+# attempts per track before it counts as failed
+MAX_TRIES = 3
+# tracks per playlist downloaded before everything else, the playlist is alarm-ready once they are settled
+READY_TRACKS = 3
+# the remaining tracks: at most this many at once, at this nice value
+BACKGROUND_WORKERS = 2
+BACKGROUND_NICE = 10
+# seconds between progress notifications, a partial refresh of the e-paper takes around half a second
+PROGRESS_INTERVAL = 2.0
+
+
+class ProgressChannel:
+    """
+    Throttled "progress changed" signal from the download threads to the main loop.
+    publish() is cheap enough for every downloaded chunk: it bumps a counter, and only the first publish
+    after the reader looked calls notify(). The reader checks changed() once due() has passed and then
+    reads the numbers themselves from DownloadQueue.progress, so it sees at most one update per interval.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL, notify=None):
+        self.interval = interval
+        self.notify = notify
+        self._lock = threading.Lock()
+        self._version = 0
+        self._seen = 0
+        self._last = 0.0
+        self._notified = False
+
+    def publish(self):
+        with self._lock:
+            self._version += 1
+            if self._notified or self.notify is None:
+                return
+            self._notified = True
+        self.notify()
+
+    def pending(self) -> bool:
+        return self._version != self._seen
+
+    def due(self) -> float:
+        """time.time() from which changed() can return True again."""
+        return self._last + self.interval
+
+    def changed(self) -> bool:
+        with self._lock:
+            now = time.time()
+            if self._version == self._seen or now < self._last + self.interval:
+                return False
+            self._seen = self._version
+            self._last = now
+            self._notified = False
+            return True
+
+
+class DownloadQueue:
+    """
+    run_job(pid, job, cancel, progress) downloads one track and returns the bytes it wrote, raising on failure.
+    It may call progress(downloaded_bytes, total_bytes) while downloading.
+    on_finished(pid, entry) is called from the runner thread once no job of a playlist is left to run.
+    cancel(pid) stops handing out that playlist's jobs, sets the event running jobs were given and
+    forgets the playlist.
+    """
+
+    def __init__(self, path: Path | str, run_job, on_finished=None, ui_pressure=None, max_workers: int = 4):
+        self.path = Path(path)
+        self.run_job = run_job
+        self.on_finished = on_finished
+        self.ui_pressure = ui_pressure
+        self.max_workers = max_workers
+        self._lock = threading.RLock()
+        self._playlists = self._load()
+        self._cancel = {pid: threading.Event() for pid in self._playlists}
+        self._thread = None
+        # the batch being downloaded: its playlist, whether it's a background batch, and its stop event
+        self._batch_pid = None
+        self._batch_background = False
+        self._batch_stop = threading.Event()
+        # progress of this session, not saved: (pid, track id) -> [downloaded, total] of downloads in flight,
+        # and per playlist the bytes and tracks finished since its first job started and when that was
+        self._live = {}
+        self._session = {}
+        self.updates = ProgressChannel()
+
+    # --- persistence ---
+    def _load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path) as f:
+                playlists = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load download queue: {e}")
+            return {}
+        for entry in playlists.values():
+            for job in entry["jobs"] or []:
+                # interrupted mid-download, the partial file is simply overwritten
+                if job["state"] == RUNNING:
+                    job["state"] = PENDING
+        return playlists
+
+    def _save(self):
+        # "running" is never the only change that gets saved, it reads back as pending anyway
+        try:
+            atomic_write_json(self.path, self._playlists)
+        except OSError as e:
+            logger.warning(f"Could not save download queue: {e}")
+
+    # --- playlists ---
+    def add(self, pid: str, name: str) -> bool:
+        """Queue a playlist whose tracks are still being listed. False if it is queued already."""
+        with self._lock:
+            if pid in self._playlists:
+                return False
+            self._playlists[pid] = {"name": name, "snapshot": None, "jobs": None}
+            self._cancel[pid] = threading.Event()
+            self._save()
+            return True
+
+    def set_jobs(self, pid: str, snapshot: str | None, tracks: list[dict]):
+        """Turn the listed tracks ({"id", "artist", "title"}) into pending jobs and start downloading."""
+        with self._lock:
+            entry = self._playlists.get(pid)
+            if entry is None:
+                return     # cancelled while listing
+            entry["snapshot"] = snapshot
+            entry["jobs"] = [{"id": t["id"], "artist": t["artist"], "title": t["title"],
+                              "state": PENDING, "tries": 0} for t in tracks]
+            self._save()
+            self.updates.publish()
+            if self._batch_background:
+                # let the runner pick this playlist's first tracks before more background work
+                self._batch_stop.set()
+        self.start()
+
+    def drop(self, pid: str):
+        """Forget a playlist without calling on_finished (listing failed, or nothing to do)."""
+        with self._lock:
+            if self._playlists.pop(pid, None) is not None:
+                self._save()
+            self._cancel.pop(pid, None)
+            self._session.pop(pid, None)
+        self.updates.publish()
+
+    def cancel(self, pid: str):
+        with self._lock:
+            event = self._cancel.get(pid)
+            if event is not None:
+                event.set()
+            if self._batch_pid == pid:
+                self._batch_stop.set()
+            self.drop(pid)
+        logger.info(f"Cancelled download of {pid}")
+
+    def queued(self) -> list[tuple[str, str, bool]]:
+        """(pid, name, listed) of every queued playlist, in queue order."""
+        with self._lock:
+            return [(pid, e["name"], e["jobs"] is not None) for pid, e in self._playlists.items()]
+
+    def progress(self, pid: str) -> dict | None:
+        """
+        Job counts of a queued playlist, None once it finished or was cancelled.
+        "ready" is True once its first READY_TRACKS jobs are done (or out of tries).
+        "partial" is how much of the running jobs is downloaded, in tracks, "bytes" what this session
+        downloaded so far, and "eta" the seconds left at the rate of this session (None until known).
+        """
+        with self._lock:
+            entry = self._playlists.get(pid)
+            if entry is None:
+                return None
+            jobs = entry["jobs"]
+            counts = {"listing": jobs is None, "total": 0, PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0,
+                      "ready": jobs is not None and all(j["state"] in (DONE, FAILED) for j in jobs[:READY_TRACKS]),
+                      "partial": 0.0, "bytes": 0, "eta": None}
+            for job in jobs or []:
+                counts["total"] += 1
+                counts[job["state"]] += 1
+            for (live_pid, _), (done, total) in self._live.items():
+                if live_pid == pid:
+                    counts["partial"] += done / total if total else 0.0
+                    counts["bytes"] += done
+            session = self._session.get(pid)
+            if session is not None:
+                counts["bytes"] += session["bytes"]
+                work = session["tracks"] + counts["partial"]
+                left = counts[PENDING] + counts[RUNNING] - counts["partial"]
+                if work > 0:
+                    counts["eta"] = (time.time() - session["start"]) * left / work
+            return counts
+
+    # --- runner ---
+    def start(self):
+        """Start the runner thread if there is none. Called by set_jobs, and once at startup to resume."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="downloads", daemon=True)
+                self._thread.start()
+
+    def _next(self):
+        # (pid, entry, jobs, background) of the next batch: the first tracks of any playlist before
+        # the rest of any playlist. jobs is empty for a playlist that has nothing left to run (every job done
+        # or failed, or no jobs at all), those are finished first wherever they are in the queue
+        listed = [(pid, e) for pid, e in self._playlists.items() if e["jobs"] is not None]
+        for pid, entry in listed:
+            if all(j["state"] in (DONE, FAILED) for j in entry["jobs"]):
+                return pid, entry, [], False
+        for pid, entry in listed:
+            head = [j for j in entry["jobs"][:READY_TRACKS] if j["state"] == PENDING]
+            if head:
+                return pid, entry, head, False
+        for pid, entry in listed:
+            rest = [j for j in entry["jobs"] if j["state"] == PENDING]
+            if rest:
+                return pid, entry, rest, True
+        return None, None, None, False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                pid, entry, todo, background = self._next()
+                if pid is None:
+                    # cleared under the lock, so a set_jobs right after this starts a new runner
+                    self._thread = None
+                    return
+                cancel = self._cancel[pid]
+                self._batch_pid = pid
+                self._batch_background = background
+                self._batch_stop = stop = threading.Event()
+
+            if todo:
+                if background:
+                    controller = AimdController(max_workers=min(BACKGROUND_WORKERS, self.max_workers),
+                                                start=1, ui_pressure=self.ui_pressure)
+                else:
+                    controller = AimdController(max_workers=self.max_workers, ui_pressure=self.ui_pressure)
+                run_adaptive(lambda job: self._run_one(pid, job, cancel), todo, controller, stop,
+                             nice=BACKGROUND_NICE if background else 0)
+                logger.debug(f"Download workers ended at {controller.limit} "
+                             f"(+{controller.increases}/-{controller.decreases})")
+                with self._lock:
+                    self._batch_pid = None
+                    self._batch_background = False
+                # jobs that failed with tries left are pending again and get picked up on the next pass
+                continue
+
+            with self._lock:
+                if self._playlists.get(pid) is not entry:
+                    continue   # cancelled in the meantime
+                del self._playlists[pid]
+                del self._cancel[pid]
+                self._session.pop(pid, None)
+                self._save()
+            self.updates.publish()
+            if self.on_finished is not None:
+                try:
+                    self.on_finished(pid, entry)
+                except Exception as e:
+                    logger.error(f"Finishing download of {pid} failed: {e}")
+
+    def _run_one(self, pid: str, job: dict, cancel: threading.Event) -> int:
+        if cancel.is_set():
+            return 0
+        key = (pid, job["id"])
+        with self._lock:
+            job["state"] = RUNNING
+            self._live[key] = [0, 0]
+            self._session.setdefault(pid, {"start": time.time(), "bytes": 0, "tracks": 0})
+        self.updates.publish()
+
+        def progress(done, total):
+            # every chunk, from the downloading thread: no lock, the reader copes with a torn pair
+            live = self._live.get(key)
+            if live is not None:
+                live[0], live[1] = done, max(total, done)
+                self.updates.publish()
+
+        try:
+            nbytes = self.run_job(pid, job, cancel, progress)
+        except Exception as e:
+            with self._lock:
+                job["tries"] += 1
+                job["state"] = FAILED if job["tries"] >= MAX_TRIES else PENDING
+                self._live.pop(key, None)
+                self._save()
+            self.updates.publish()
+            if not cancel.is_set():
+                # Log the error so you can inspect it in your logs, but don't dump to screen
+                logger.error(f"Failed to download [{job['artist']} - {job['title']}] "
+                             f"(try {job['tries']}/{MAX_TRIES}): {e}")
+            return 0
+        with self._lock:
+            job["state"] = DONE
+            live = self._live.pop(key, None)
+            session = self._session.get(pid)
+            if session is not None:
+                session["bytes"] += live[0] if live else 0
+                session["tracks"] += 1
+            self._save()
+        self.updates.publish()
+        return nbytes
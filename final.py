@@ -9,7 +9,6 @@ import sys
 import time
 import subprocess
 import schedule
-import glob
 import random
 import requests
 import threading
@@ -22,10 +21,15 @@ from PIL import Image, ImageDraw, ImageFont
 from gpiozero import RotaryEncoder, Button, DigitalInputDevice
 
 signal.signal(signal.SIGINT, signal.default_int_handler)
+signal.signal(signal.SIGTERM, signal.default_int_handler)   # systemd stop also runs the cleanup below
 #spi_lock = threading.Lock()
 
-from alarm import Alarm
-from icons import get_bell_bitmap, get_download_bitmap, get_sunrise_bitmap
+from alarm import AlarmSet, DAY_PRESETS
+from icons import get_bell_bitmap, get_sunrise_bitmap, get_icon
+from sprites import SpriteAtlas, TIME_CHARS, DATE_CHARS
+from panel import Panel
+from scheduler import Deadlines
+from render_worker import RenderWorker
 from spotify_service import SpotifyService
 from light_control import sunrise_effect
 import light_control
@@ -53,22 +57,40 @@ class State(Enum):
     SET_SUNRISE  = auto()
     SELECT_SOUND = auto()
     DOWNLOAD_FAILED = auto()
+    SELECT_ALARM = auto()
+    SET_DAYS     = auto()
 
 class Display:
     def __init__(self):
         # initialize e-paper
         self.epd = epd3in7.EPD()
-        self.epd.init(0); self.epd.Clear(0xFF, 0)
-        self.epd.init(1); self.epd.Clear(0xFF, 1)
+        self.panel = Panel(self.epd)    # only sends the changed windows on partial updates
+        self.epd.init(0); self.panel.clear(0)
+        self.epd.init(1); self.panel.clear(1)
         self.width  = self.epd.height
         self.height = self.epd.width
 
+        # one preallocated canvas that every draw_* method paints into
+        self.canvas      = Image.new('1', (self.width, self.height), 255)
+        self.canvas_draw = ImageDraw.Draw(self.canvas)
+
         # fonts
         self.font_time  = ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf', 120)
         self.font_date  = ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf', 30)
         self.small_font = ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf', 28)
         self.menu_font  = ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf', 25)
 
+        # pre-rendered clock digits, date glyphs and icons (built once, cached on disk)
+        self.atlas = SpriteAtlas(
+            fonts={"time": (self.font_time, TIME_CHARS), "date": (self.font_date, DATE_CHARS)},
+            icons={"bell": get_bell_bitmap, "sunrise": get_sunrise_bitmap},
+        )
+        self.time_glyphs = self.atlas.glyphs["time"]
+        self.date_glyphs = self.atlas.glyphs["date"]
+
+        # main loop wakeups, input callbacks notify() it so the loop reacts right away
+        self.deadlines = Deadlines()
+
         # GPIO setup
         self.encoder    = RotaryEncoder(a=17, b=25, max_steps=100)
         self.button     = Button(23, bounce_time=0.1, hold_time=5)
@@ -83,7 +105,11 @@ class Display:
         self.prev_state    = None
         self.menu_index    = 0
         schedule.every(8).hours.do(self.full_refresh)
-        self.alarm   = Alarm()
+        self.alarms  = AlarmSet()
+        self.alarm   = self.alarms.alarms[0]   # the alarm being edited in the menu
+        self.ringing = self.alarm              # the alarm that went off last
+        self.alarm_index = 0
+        self.days_index  = 0
 
         # snooze button
         self.snooze_button = Button(24, pull_up=True, bounce_time=0.2, hold_time=2)
@@ -95,20 +121,28 @@ class Display:
         # Spotify integration and playback
         self.spotify  = SpotifyService()
         self.sp_index = 0
+        self.display_playlists = []
+        self.playlist_load_failed = False   # set by the catalog refresh thread, handled in the main loop
         self.download_failed_time = None
+        self.download_pid      = None   # playlist the DOWNLOAD_PL screen is waiting for
+        self.download_progress = None   # its last job counts from the download queue
+        # the download threads wake the main loop when there's progress to show, at most every couple of seconds
+        self.spotify.download_updates.notify = self.deadlines.notify
+        self.spotify.resume_downloads()
         self.max_digital_gain = 20
         self.play_thread = None
         self.stop_play_event = threading.Event()
         self.play_proc = None
 
         #light
+        # connect to the bulbs now (SHELLY_IPS in light_control.py), their state is mirrored from here on
+        light_control.get_lights()
         self.light_switch = DigitalInputDevice(16, pull_up=True, bounce_time=0.2)
         self.light_switch.when_activated   = self.light_on_handler
         self.light_switch.when_deactivated = self.light_off_handler
         self.sunrise_started = False
         self.sunrise_triggered = False
-        self.sunrise_cancelled = False
-        self.light_on = False
+        self.sunrise_cancel = threading.Event()   # set to stop a running sunrise right away
 
         # rotary buffering
         self._click_buffer    = 0
@@ -127,15 +161,31 @@ class Display:
         self.last_volume = None
         self.last_pot_check = time.time()
         self.pot_check_interval = 0.1
+        self.pot_idle_interval  = 0.5   # slower polling once the knob has been left alone for a few seconds
+        self.last_pot_change    = time.time()
         self.display_is_refreshing = False
         self._pending_open_pot = False
+        # the display thread and the main loop share the spi bus: panel writes, pot open/close and pot reads
+        # all happen under this lock, so a read can't hit a closed pot or overlap an e-paper transfer
+        self.spi_lock = threading.Lock()
         self.ALLOWED_POT_STATES = {State.CLOCK, State.PLAYBACK, State.ALARM}
 
+        # display thread, render() only asks it for a new frame (see render_worker.py)
+        self.renderer = RenderWorker(self.draw_frame)
+
+        # downloads back off while the clock itself gets slow (see download_pool.py)
+        self.max_loop_lag      = 0.1    # s the main loop may wake up late on average
+        self.max_partial_time  = 1.0    # s a partial frame may take on average
+        self.spotify.ui_pressure = self.ui_pressure
+
     # --- Draw different screens ----------------------------------------------------------------
 
     def get_menu_items(self):
+        number = self.alarms.alarms.index(self.alarm) + 1
         base = [
+            f"Alarms: #{number} of {len(self.alarms)}",
             f"Set Alarm: {self.alarm.time_str()}",
+            f"Repeat: {self.alarm.days_str()}",
             "Alarm: ON" if self.alarm.enabled else "Alarm: OFF",
             f"Snooze: {self.alarm.snooze_minutes} min",
             "Sunrise: ON" if self.alarm.sunrise_enabled else "Sunrise: OFF",
@@ -146,43 +196,51 @@ class Display:
             label = f"Alarm Sound: Spotify ({self.alarm.playlist_name or 'None'})"
         else:
             label = f"Alarm Sound: {sound_type}"
-        base.append(label)        
-        return base + ["Play Test"]
+        base.append(label)
+        base.append("Play Test")
+        if len(self.alarms) > 1:
+            base.append("Delete Alarm")
+        return base
+
+    def new_frame(self):
+        # wipe and reuse the canvas instead of allocating a new image for every frame
+        self.canvas_draw.rectangle((0, 0, self.width, self.height), fill=255)
+        return self.canvas, self.canvas_draw
 
     def draw_clock(self):
         now = datetime.now()
         t   = now.strftime("%H:%M")
         d   = now.strftime("%a, %d %b")
         #clear e-paper
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, _ = self.new_frame()
 
-        #draw clock
-        tb = draw.textbbox((0,0), t, font=self.font_time)
+        #draw clock from the pre-rendered digit tiles
+        tb = self.time_glyphs.bbox(t)
         x  = (self.width - (tb[2]-tb[0])) // 2
         y  = (self.height - (tb[3]-tb[1]) - 50) // 2 - 10
-        draw.text((x,y), t, font=self.font_time, fill=0)
+        self.time_glyphs.draw(img, (x,y), t)
 
         #draw date
-        db = draw.textbbox((0,0), d, font=self.font_date)
+        db = self.date_glyphs.bbox(d)
         dx = (self.width - (db[2]-db[0])) // 2
         dy = self.height - (db[3]-db[1]) - 28
-        draw.text((dx,dy), d, font=self.font_date, fill=0)
+        self.date_glyphs.draw(img, (dx,dy), d)
 
         #draw alarm and sunrise icons if enabled
-        if self.alarm.enabled:
-            bell = get_bell_bitmap()
+        if self.alarms.any_enabled():
+            bell = self.atlas.icons["bell"]
             bx = self.width - 45
             by = 20
             img.paste(bell, (bx, by))
-            if self.alarm.is_snoozed() and self.blink_state:
+            if self.alarms.snoozed() is not None and self.blink_state:
                 txt = "Zzz"
-                bb  = draw.textbbox((0,0), txt, font=self.font_date)
+                bb  = self.date_glyphs.bbox(txt)
                 sx  = bx + (bell.width - (bb[2]-bb[0])) // 2
                 sy  = by + bell.height + 5
-                draw.text((sx, sy), txt, font=self.font_date, fill=0)
-            if self.alarm.sunrise_enabled:
-                sun = get_sunrise_bitmap()
+                self.date_glyphs.draw(img, (sx, sy), txt)
+            upcoming = self.alarms.upcoming()
+            if upcoming is not None and upcoming.sunrise_enabled:
+                sun = self.atlas.icons["sunrise"]
                 sx = bx - sun.width - 10
                 sy = by - 5
                 img.paste(sun, (sx, sy))
@@ -190,10 +248,11 @@ class Display:
 
     def draw_menu(self):
         items = self.get_menu_items()
-        img   = Image.new('1', (self.width, self.height), 255)
-        draw  = ImageDraw.Draw(img)
-        for i, txt in enumerate(items):
-            y = 20 + i*35
+        img, draw = self.new_frame()
+        # only 7 lines fit, scroll so the selected one stays visible
+        first = max(0, min(self.menu_index - 3, len(items) - 7))
+        for i, txt in enumerate(items[first:first + 7], start=first):
+            y = 20 + (i - first)*35
             prefix = "> " if i == self.menu_index else "   "
             base_indent = 20
             extra_indent = 10 if prefix.strip() == ">" else 0
@@ -202,8 +261,7 @@ class Display:
         return img
 
     def draw_time_adjust(self):
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         hh, mm = f"{self.alarm.hour:02}", f"{self.alarm.minute:02}"
         tb = draw.textbbox((0,0), "00:00", font=self.font_time)
         x0 = (self.width - (tb[2]-tb[0])) // 2
@@ -222,8 +280,7 @@ class Display:
         return img
 
     def draw_set_snooze(self):
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         s = f"{self.alarm.snooze_minutes} min"
         tb = draw.textbbox((0,0), s, font=self.font_time)
         x = (self.width - (tb[2]-tb[0])) // 2
@@ -233,8 +290,7 @@ class Display:
 
     def draw_alarm_off(self):
         #flashes when alarm is disabled with snooze button long hold
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         txt = "Alarm Disabled"
         tb = draw.textbbox((0,0), txt, font=self.small_font)
         x = (self.width - (tb[2]-tb[0])) // 2
@@ -243,8 +299,7 @@ class Display:
         return img
 
     def draw_playback(self):
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         sound_type = getattr(self.alarm, 'sound_type', 'Classic')
         if sound_type == "Spotify":
             label = self.alarm.playlist_name or 'None'
@@ -263,8 +318,7 @@ class Display:
         return img
 
     def draw_set_sunrise(self):
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         s = f"{self.alarm.sunrise_minutes} min"
         tb = draw.textbbox((0,0), s, font=self.font_time)
         x = (self.width - (tb[2]-tb[0])) // 2
@@ -274,28 +328,27 @@ class Display:
 
     def draw_alarm(self):
         #screen when alarm is going off
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, _ = self.new_frame()
 
-        draw.text((15, 10), "Good Morning!", font=self.font_date, fill=0)
+        self.date_glyphs.draw(img, (15, 10), "Good Morning!")
 
         #draw clock
         now = datetime.now()
         t = now.strftime("%H:%M")
-        tb = draw.textbbox((0,0), t, font=self.font_time)
+        tb = self.time_glyphs.bbox(t)
         x  = (self.width - (tb[2]-tb[0])) // 2
         y  = (self.height - (tb[3]-tb[1])) // 2 - 10
-        draw.text((x,y), t, font=self.font_time, fill=0)
+        self.time_glyphs.draw(img, (x,y), t)
 
         #draw date
         d   = now.strftime("%a, %d %b")
-        db = draw.textbbox((0,0), d, font=self.font_date)
+        db = self.date_glyphs.bbox(d)
         dx = (self.width - (db[2]-db[0])) // 2
         dy = self.height - (db[3]-db[1]) - 25
-        draw.text((dx,dy), d, font=self.font_date, fill=0)
+        self.date_glyphs.draw(img, (dx,dy), d)
         
         #icon anchor
-        bell = get_bell_bitmap()
+        bell = self.atlas.icons["bell"]
         bx = self.width - bell.width - 20
         by = 25
 
@@ -304,8 +357,8 @@ class Display:
             img.paste(bell, (bx, by))
 
         #draw sunrise if enabled
-        if self.alarm.sunrise_enabled:
-            sun = get_sunrise_bitmap()
+        if self.ringing.sunrise_enabled:
+            sun = self.atlas.icons["sunrise"]
             sx = bx - sun.width - 15
             sy = by - 5
             img.paste(sun, (sx, sy))
@@ -313,14 +366,18 @@ class Display:
 
     def draw_playlist_selector(self):
         #for spotify polaylist selection
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
-        icon = get_download_bitmap().resize((16, 16), Image.NEAREST)
+        img, draw = self.new_frame()
+        icon = get_icon("download", (16, 16))   # decoded and scaled once, then cached
 
         # Precompute the height of a text line
         tb = draw.textbbox((0, 0), "Ay", font=self.menu_font)
         line_height = tb[3] - tb[1]
 
+        if not self.display_playlists:
+            # first run without a cached catalog, the list is drawn as soon as it arrives
+            draw.text((30, self.height//2 - 10), "Loading playlists...", font=self.font_date, fill=0)
+            return img
+
         for i, (name, pid) in enumerate(self.display_playlists[:8]):
             y = 20 + i * 30
             base_indent = 20
@@ -350,17 +407,34 @@ class Display:
 
     def draw_downloading(self):
         #show downloading screen while waiting for spotify playlist to download
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
-        draw.text((30,self.height//2-10), "Downloading...", font=self.font_date, fill=0)
-        draw.text((30,self.height//2+20), "Hold to cancel",    font=self.font_date, fill=0)
+        img, draw = self.new_frame()
+        progress = self.download_progress
+        if not progress or progress["listing"] or not progress["total"]:
+            draw.text((30,self.height//2-10), "Downloading...", font=self.font_date, fill=0)
+            draw.text((30,self.height//2+20), "Hold to cancel",    font=self.font_date, fill=0)
+            return img
+
+        # tracks done, a bar that also moves while a track downloads, then megabytes and time left
+        total = progress["total"]
+        settled = progress["done"] + progress["failed"]
+        draw.text((30, 40), f"Downloading {settled}/{total}", font=self.font_date, fill=0)
+        x0, y0, x1, y1 = 30, 90, self.width - 30, 120
+        draw.rectangle((x0, y0, x1, y1), outline=0, width=2)
+        fraction = min(1.0, (settled + progress["partial"]) / total)
+        if fraction > 0:
+            draw.rectangle((x0 + 4, y0 + 4, x0 + 4 + int((x1 - x0 - 8) * fraction), y1 - 4), fill=0)
+        details = f"{progress['bytes'] / 1e6:.1f} MB"
+        if progress["eta"] is not None:
+            minutes = progress["eta"] / 60
+            details += ", <1 min left" if minutes < 1 else f", ~{minutes:.0f} min left"
+        draw.text((30, 135), details, font=self.menu_font, fill=0)
+        draw.text((30, 200), "Hold to cancel", font=self.font_date, fill=0)
         return img
 
     def draw_sound_selector(self):
         # select alarm sound type, these options must correspond to the ones in alarm.py
         # these also must have .wav files in the /data/alarms/ folder
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         options = ["Classic", "Nature", "Guitar", "Ambient", "Silent", "Spotify"]
         for i, opt in enumerate(options):
             y = 20 + i * 35
@@ -377,10 +451,31 @@ class Display:
             draw.text((x, y), prefix + label, font=self.menu_font, fill=0)
         return img
 
+    def draw_alarm_selector(self):
+        # list of all alarms plus an entry to add a new one
+        img, draw = self.new_frame()
+        rows = [f"{a.time_str()}  {a.days_str()[:14]}  {'ON' if a.enabled else 'OFF'}" for a in self.alarms.alarms]
+        rows.append("+ New Alarm")
+        first = max(0, min(self.alarm_index - 3, len(rows) - 7))
+        for i, label in enumerate(rows[first:first + 7], start=first):
+            y = 20 + (i - first) * 35
+            prefix = "> " if i == self.alarm_index else "   "
+            x = 30 if i == self.alarm_index else 20
+            draw.text((x, y), prefix + label, font=self.menu_font, fill=0)
+        return img
+
+    def draw_set_days(self):
+        img, draw = self.new_frame()
+        s = DAY_PRESETS[self.days_index][0]
+        tb = draw.textbbox((0,0), s, font=self.small_font)
+        x = (self.width - (tb[2]-tb[0])) // 2
+        y = (self.height - (tb[3]-tb[1])) // 2
+        draw.text((x,y), s, font=self.small_font, fill=0)
+        return img
+
     def draw_download_failed(self):
         #screen when spotify download fails, automatically falls back to classic alarm
-        img = Image.new('1', (self.width, self.height), 255)
-        draw = ImageDraw.Draw(img)
+        img, draw = self.new_frame()
         msg1 = "Download Failed"
         msg2 = "Using Classic Alarm"
         y = self.height // 2 - 30
@@ -396,14 +491,25 @@ class Display:
     def handle_snooze_short(self):
         #short press snooze button
         self.snooze_short = True
+        self.deadlines.notify()
 
     def handle_snooze_long(self):
         #long press snooze button
         self.snooze_long = True
+        self.deadlines.notify()
+
+    def ui_pressure(self):
+        # called from the download workers, reason string when they should back off
+        if self.deadlines.lag > self.max_loop_lag:
+            return f"main loop {self.deadlines.lag*1000:.0f} ms late"
+        if self.renderer.partial_time > self.max_partial_time:
+            return f"frames take {self.renderer.partial_time:.1f} s"
+        return None
 
     def handle_menu_long_press(self):
         #long press on select button
         self.menu_long_press = True
+        self.deadlines.notify()
 
     def on_rotate(self):
         #rotary encoder rotation handler
@@ -415,16 +521,18 @@ class Display:
 
         #if in clock state the rotate handles brightness adjustment
         #else it is menu navigation 
-        if self.current_state == State.CLOCK and self.light_on:
-            self.handle_brightness_adjustment()
+        if self.current_state == State.CLOCK and self.light_dimmable:
+            self.handle_brightness_adjustment(delta)
         else:
             self._click_buffer += delta
 
         self.last_input     = datetime.now()
+        self.deadlines.notify()
 
     def on_press(self):
         #rotary encoder short button press handler
         self.last_input = datetime.now()
+        self.deadlines.notify()
         st = self.current_state
 
         #short press goes immediately to menu when in clock state
@@ -439,9 +547,29 @@ class Display:
         elif st == State.MENU:
             choice = self.get_menu_items()[self.menu_index]
 
-            if choice.startswith("Set Alarm"):
-                blank = Image.new('1', (self.width, self.height), 255)
-                self.display_partial(blank)
+            if choice.startswith("Alarms:"):
+                self.current_state = State.SELECT_ALARM
+                self.alarm_index   = self.alarms.alarms.index(self.alarm)
+                self.last_steps    = self.encoder.steps
+                self.render()
+                return
+
+            elif choice.startswith("Repeat:"):
+                self.current_state = State.SET_DAYS
+                presets = [days for _, days in DAY_PRESETS]
+                self.days_index = presets.index(self.alarm.weekdays) if self.alarm.weekdays in presets else 0
+                self.last_steps = self.encoder.steps
+                self.render()
+                return
+
+            elif choice == "Delete Alarm":
+                self.alarms.remove(self.alarm)
+                self.alarm      = self.alarms.alarms[0]
+                self.menu_index = 0
+                self.render()
+                return
+
+            elif choice.startswith("Set Alarm"):
                 self.current_state = State.SET_HOUR
                 self.last_steps    = self.encoder.steps
                 self.prev_state    = None
@@ -469,7 +597,7 @@ class Display:
                 self.render()
                 return
 
-            elif choice == "Sunrise Start:":
+            elif choice.startswith("Sunrise Start:"):
                 self.current_state = State.SET_SUNRISE
                 self.last_steps    = self.encoder.steps
                 self.render()
@@ -477,7 +605,7 @@ class Display:
 
             elif choice.startswith("Sunrise:"):
                 self.alarm.sunrise_enabled = not self.alarm.sunrise_enabled
-                self.alarm.save()
+                self.alarm.save(flush=True)
                 self.render()
                 return
 
@@ -502,40 +630,36 @@ class Display:
                 self.current_state = State.SELECT_PL
                 self.sp_index      = 0
                 self.prev_state    = None
-                try:
-                    self.display_playlists = self.spotify.enter_playlist_menu()
-                except Exception as e:
-                    print(f"[Spotify] playlist load failed: {e}")
-                    # fall back exactly like your existing download-failed path
-                    self.alarm.sound_type = "Classic"
-                    self.alarm.save()
-                    self.current_state = State.DOWNLOAD_FAILED
-                    self.download_failed_time = datetime.now()
-                    self.prev_state = None
-                    self.render()
-                    return
+                # cached list right away, a fresh one replaces it when it arrives
+                self.display_playlists = self.spotify.enter_playlist_menu(
+                    on_update=self.playlists_updated, on_error=self.playlists_failed)
             else:
                 self.current_state = State.MENU
             self.render()
             return
 
         elif st == State.SELECT_PL:
+            if not self.display_playlists:
+                return   # still loading
             name, pid = self.spotify.select(self.sp_index)
-            if not self.spotify.is_downloaded(pid):
+            # a playlist that changed since it was downloaded is synced again (only the difference)
+            if not self.spotify.is_synced(pid):
                 # record for persistence
                 self.alarm.playlist_id = pid
                 self.alarm.playlist_name = name
                 self.alarm.sound_type = "Spotify"
                 self.alarm.save()
 
-                # spawn our background thread (not a Popen)
+                # queue the download, it runs in the background and survives a restart
                 print(f"[DEBUG] Selected playlist: {name} ({pid})")
-                self.download_thread = self.spotify.download_playlist(pid, name)
+                self.spotify.download_playlist(pid, name)
+                self.download_pid = pid
+                self.download_progress = self.spotify.download_progress(pid)
 
                 # switch into the downloading screen
                 self.current_state = State.DOWNLOAD_PL
             else:
-                # If already downloaded, just update alarm settings and return to menu
+                # If already up to date, just update alarm settings and return to menu
                 self.alarm.playlist_id = pid
                 self.alarm.playlist_name = name
                 self.alarm.sound_type = "Spotify"
@@ -546,18 +670,30 @@ class Display:
             self.render()
             return
 
+        elif st == State.SELECT_ALARM:
+            if self.alarm_index < len(self.alarms):
+                self.alarm = self.alarms.alarms[self.alarm_index]
+            else:
+                self.alarm = self.alarms.add()
+            self.current_state = State.MENU
+            self.menu_index    = 0
+            self.last_steps    = self.encoder.steps
+        elif st == State.SET_DAYS:
+            self.current_state = State.MENU
+            self.last_steps    = self.encoder.steps
+            self.alarm.save(flush=True)
         elif st == State.SET_HOUR:
             self.current_state = State.SET_MINUTE
             self.last_steps    = self.encoder.steps
-            self.alarm.save()
+            self.alarm.save(flush=True)
         elif st == State.SET_MINUTE:
             self.current_state = State.MENU
             self.last_steps    = self.encoder.steps
-            self.alarm.save()
+            self.alarm.save(flush=True)
         elif st == State.SET_SNOOZE:
             self.current_state = State.MENU
             self.last_steps    = self.encoder.steps
-            self.alarm.save()
+            self.alarm.save(flush=True)
         elif st == State.PLAYBACK:
             self.stop_alarm_playback()   # <-- use the proper stop
             self.current_state = State.MENU
@@ -571,7 +707,7 @@ class Display:
         elif st == State.SET_SUNRISE:
             self.current_state = State.MENU
             self.last_steps    = self.encoder.steps
-            self.alarm.save()
+            self.alarm.save(flush=True)
         else:
             self.current_state = State.MENU
             self.last_steps    = self.encoder.steps
@@ -584,10 +720,34 @@ class Display:
 
     ## pot handler
     def get_volume_percent(self):
-        if self.pot is not None:
-            return int(self.pot.value * 100)
+        value = self.read_pot()
+        if value is not None:
+            return int(value * 100)
         return self.last_volume if self.last_volume is not None else 50
 
+    def read_pot(self):
+        # None when the pot is closed or the panel owns the spi bus right now, never waits for a refresh
+        if not self.spi_lock.acquire(blocking=False):
+            return None
+        try:
+            return self.pot.value if self.pot is not None else None
+        finally:
+            self.spi_lock.release()
+
+    # playlist catalog refresh, called from its background thread
+    def playlists_updated(self, pairs):
+        self.display_playlists = pairs
+        self.sp_index = max(0, min(self.sp_index, min(7, len(pairs) - 1)))
+        if self.current_state == State.SELECT_PL:
+            self.render()
+
+    def playlists_failed(self, error):
+        print(f"[Spotify] playlist load failed: {error}")
+        # offline with a cached list is fine, only an empty selector needs the fallback
+        if not self.display_playlists:
+            self.playlist_load_failed = True
+            self.deadlines.notify()
+
     #alarm and spotify playback
     def _spawn_aplay_and_wait(self, filepath: str):
         # Blocks until the process exits
@@ -664,13 +824,14 @@ class Display:
         try: mixer.setvolume(int(target_percent))
         except: pass
 
-    def start_alarm_playback(self):
-        ## main alarm function
+    def start_alarm_playback(self, alarm=None):
+        ## main alarm function, plays the sound of the given alarm (the one being edited for "Play Test")
+        alarm = alarm or self.alarm
         
         # Stop any previous playback thread/process first
         self.stop_alarm_playback()
 
-        sound_type = self.alarm.sound_type or "Classic"
+        sound_type = alarm.sound_type or "Classic"
 
         # Resolve file(s)
         if sound_type == "Silent":
@@ -685,19 +846,22 @@ class Display:
             files = ["/data/Music/alarm_sounds/ambient.wav"]
         elif sound_type == "Spotify":
             # Collect local tracks (prefer wavs; fall back to mp3/m4a if needed)
-            pid = self.alarm.playlist_id
+            pid = alarm.playlist_id
             if not pid:
                 # fallback to Classic if no PID
-                self.alarm.sound_type = "Classic"
-                self.alarm.save()
-                return self.start_alarm_playback()
-            base = f"{self.spotify.music_dir}/{pid}"
-            files = sorted(glob.glob(f"{base}/*.wav"))
-            if not files:
+                alarm.sound_type = "Classic"
+                alarm.save()
+                return self.start_alarm_playback(alarm)
+            # only finished tracks, the playlist may still be downloading
+            files = [str(f) for f in self.spotify.playable_tracks(pid)]
+            if not files and self.spotify.download_progress(pid) is not None:
+                # its first tracks aren't in yet: beep this time, but keep the playlist for next time
+                files = ["/data/Music/alarm_sounds/classic_beep.wav"]
+            elif not files:
                 # nothing downloaded -> fallback
-                self.alarm.sound_type = "Classic"
-                self.alarm.save()
-                return self.start_alarm_playback()
+                alarm.sound_type = "Classic"
+                alarm.save()
+                return self.start_alarm_playback(alarm)
         else:
             return
 
@@ -738,71 +902,74 @@ class Display:
         self.play_thread = None
 
     #light controls
+    # the bulbs' state comes from light_control's mirror, so switching them from the app shows up here too
+    # and a command the bulbs are already doing is never sent
+    @property
+    def light_on(self):
+        return light_control.get_lights().is_on()
+
+    @property
+    def light_dimmable(self):
+        # on in white mode. while a sunrise runs the bulbs are on in colour mode and the encoder leaves
+        # them alone, only the wall switch cancels a sunrise
+        return light_control.get_lights().is_white()
+
     def light_on_handler(self):
-        if self.light_on:
-            return
-        self.light_on = True
-        self.sunrise_cancelled = True
+        self.sunrise_cancel.set()
         light_control.turn_on()
 
     def light_off_handler(self):
-        if not self.light_on:
-            return
-        self.light_on = False
-        self.sunrise_cancelled = True
+        self.sunrise_cancel.set()
         light_control.turn_off()
 
-    def sunrise_cancelled_check(self):
-        return self.sunrise_cancelled
-
-    def handle_brightness_adjustment(self):
+    def handle_brightness_adjustment(self, delta):
+        # no throttling needed here: light_control only queues the value and sends the newest one
         if self.current_state != State.CLOCK:
             return
-        if not self.light_on:
+        if not self.light_dimmable:
             return
-        now=time.time()
-        if not hasattr(self, 'last_gain_update'):
-            self.last_gain_update = 0
-        if not hasattr(self, 'last_sent_gain'):
-            self.last_sent_gain = None
-        if now - self.last_gain_update < 0.3:
-            return  # throttle updates
-
-        delta = self.encoder.steps
         if delta == 0:
             return
-        self.encoder.steps = 0
-        self.last_gain_update = now
-        current = light_control.current_gain
-        new_gain = max(1, min(100, current + delta * 3))
-        if new_gain != self.last_sent_gain:
-            light_control.set_brightness(new_gain)
-            self.last_sent_gain = new_gain
+        # the mirror already includes values queued but not sent yet, so fast turns add up
+        current = light_control.get_lights().gain
+        light_control.set_brightness(max(1, min(100, current + delta * 3)))
 
 # --- Display -----------------------------------------------------------------
 
     # full and partial display refresh. clears all ghosting
     ## be careful, depending on the e-ink model these commands may be different or not exist at all
     ## these are called throughout the logic to clear the display of errant pixels
+    ## frames are packed into panel orientation by panel.py, no rotate/getbuffer needed here
     def display_full(self, img):
-        self.display_is_refreshing = True
-        img = img.rotate(180)
-        time.sleep(0.02)
-        self.epd.init(0); self.epd.Clear(0xFF, 0)
-        self.epd.display_1Gray(self.epd.getbuffer(img))
-        self.epd.init(1)
-        time.sleep(0.02)
-        self.display_is_refreshing = False
+        with self.spi_lock:
+            self.display_is_refreshing = True
+            time.sleep(0.02)
+            self.panel.full(img)
+            time.sleep(0.02)
+            self.display_is_refreshing = False
 
     def display_partial(self, img):
-        self.display_is_refreshing = True
-        time.sleep(0.02)
-        img = img.rotate(180)
-        self.epd.display_1Gray(self.epd.getbuffer(img))
-        time.sleep(0.02)
-        self.display_is_refreshing = False
+        # only the windows that differ from the last frame are written, identical frames are dropped (see panel.py)
+        with self.spi_lock:
+            self.display_is_refreshing = True
+            time.sleep(0.02)
+            self.panel.partial(img)
+            time.sleep(0.02)
+            self.display_is_refreshing = False
 
     def render(self):
+        # never blocks: the display thread draws the current state as soon as the panel is free,
+        # several requests during one refresh end up as a single frame
+        self.renderer.request()
+
+    def draw_frame(self, full):
+        # runs on the display thread
+        if full:
+            self.display_full(self.draw_clock())
+        else:
+            self.render_now()
+
+    def render_now(self):
         entering = self.current_state
         leaving  = self.prev_state
 
@@ -810,20 +977,21 @@ class Display:
         if entering != leaving:
             # If we’re leaving a pot-enabled state, close MCP *before* display work
             if leaving in self.ALLOWED_POT_STATES and entering not in self.ALLOWED_POT_STATES:
-                if self.pot is not None:
-                    try:
-                        self.pot.close()
-                    except Exception as e:
-                        print("Error closing MCP3008:", e)
-                    self.pot = None
-                    self._pot_active_state = None
-                time.sleep(0.05)  # small SPI settle so epaper can own the bus
+                with self.spi_lock:
+                    if self.pot is not None:
+                        try:
+                            self.pot.close()
+                        except Exception as e:
+                            print("Error closing MCP3008:", e)
+                        self.pot = None
+                        self._pot_active_state = None
+                    time.sleep(0.05)  # small SPI settle so epaper can own the bus
 
             # If we’re entering a pot-enabled state, we’ll (re)open MCP *after* display
             self._pending_open_pot = (entering in self.ALLOWED_POT_STATES)
 
             # Clear previous frame artifacts on a state change
-            blank = Image.new('1', (self.width, self.height), 255)
+            blank, _ = self.new_frame()
             self.display_partial(blank)
             self.prev_state = entering
 
@@ -851,25 +1019,90 @@ class Display:
             img = self.draw_sound_selector()
         elif self.current_state == State.DOWNLOAD_FAILED:
             img = self.draw_download_failed()
+        elif self.current_state == State.SELECT_ALARM:
+            img = self.draw_alarm_selector()
+        elif self.current_state == State.SET_DAYS:
+            img = self.draw_set_days()
 
         else:
             img = self.draw_menu()
 
         self.display_partial(img)
 
-        if self._pending_open_pot and self.pot is None:
-            try:
-                self.pot = MCP3008(channel=0)
-                self._pot_active_state = self.current_state
-            except Exception as e:
-                print(f"Failed to open MCP3008: {e}")
-            finally:
+        if self._pending_open_pot:
+            with self.spi_lock:
+                if self.pot is None:
+                    try:
+                        self.pot = MCP3008(channel=0)
+                        self._pot_active_state = self.current_state
+                    except Exception as e:
+                        print(f"Failed to open MCP3008: {e}")
                 self._pending_open_pot = False
 
 # --- Main Loop --------------------------------------------------------------
 
     def full_refresh(self):
-        self.display_full(self.draw_clock())
+        self.renderer.request(full=True)
+
+    def plan_wakeups(self, last_full, alarm_off_time):
+        # work out when the main loop next has something to do, see scheduler.py
+        dl  = self.deadlines
+        now = time.time()
+
+        dl.set("minute", (int(now) // 60 + 1) * 60)
+        dl.set("full_refresh", last_full.timestamp() + 8 * 3600)
+        idle = schedule.idle_seconds()
+        dl.set("schedule", now + (60 if idle is None else max(0.0, idle)))
+
+        # next alarm, sunrise start, snooze end or grace period end. a deadline that already passed
+        # but couldn't act (not in CLOCK) is picked up by the next input or minute tick instead
+        head = self.alarms.peek(now)
+        if head is not None and head[0] > now:
+            dl.set("alarm", head[0])
+        else:
+            dl.clear("alarm")
+
+        if self.alarms.snoozed() is not None or self.current_state == State.ALARM:
+            dl.set("blink", self.last_blink.timestamp() + 0.5)
+        else:
+            dl.clear("blink")
+
+        if self.current_state == State.ALARM_OFF and alarm_off_time:
+            dl.set("alarm_off", alarm_off_time.timestamp() + 2)
+        else:
+            dl.clear("alarm_off")
+
+        if self.current_state == State.DOWNLOAD_FAILED and self.download_failed_time:
+            dl.set("download_failed", self.download_failed_time.timestamp() + 2)
+        else:
+            dl.clear("download_failed")
+
+        if self.current_state not in (State.CLOCK, State.ALARM, State.DOWNLOAD_PL, State.PLAYBACK):
+            dl.set("inactivity", self.last_input.timestamp() + 15)
+        else:
+            dl.clear("inactivity")
+
+        if self._click_buffer:
+            dl.set("click", self._last_click_time.timestamp() + self._click_throttle)
+        else:
+            dl.clear("click")
+
+        if self.pot is not None:
+            recently_moved = now - self.last_pot_change < 3
+            interval = self.pot_check_interval if recently_moved else self.pot_idle_interval
+            due = self.last_pot_check + interval
+            if self.display_is_refreshing:
+                # polling is skipped while the panel owns the spi bus, don't spin on it
+                due = max(due, now + self.pot_check_interval)
+            dl.set("pot", due)
+        else:
+            dl.clear("pot")
+
+        # download progress: notify() wakes the loop, this holds the update back until the channel's interval is over
+        if self.download_pid and self.spotify.download_updates.pending():
+            dl.set("download", self.spotify.download_updates.due())
+        else:
+            dl.clear("download")
 
     def run(self):
         self.full_refresh()
@@ -883,20 +1116,23 @@ class Display:
             now = datetime.now()
             now_ts= time.time()
 
-            # potentiometer polling
+            # potentiometer polling, a read that finds the display thread on the spi bus is skipped
             if(
                 self.pot is not None
                 and not self.display_is_refreshing
                 and now_ts - self.last_pot_check >= self.pot_check_interval
             ):
-                volume = max(0, min(100, int(self.pot.value * 100)))
-                if self.last_volume is None or abs(volume - self.last_volume) >= 2:
-                    try:
-                        mixer = alsaaudio.Mixer('Master', cardindex=1)
-                        mixer.setvolume(volume)
-                        self.last_volume = volume
-                    except alsaaudio.ALSAAudioError as e:
-                        print("Volume error (Master@card1):", e)
+                value = self.read_pot()
+                if value is not None:
+                    volume = max(0, min(100, int(value * 100)))
+                    if self.last_volume is None or abs(volume - self.last_volume) >= 2:
+                        self.last_pot_change = now_ts
+                        try:
+                            mixer = alsaaudio.Mixer('Master', cardindex=1)
+                            mixer.setvolume(volume)
+                            self.last_volume = volume
+                        except alsaaudio.ALSAAudioError as e:
+                            print("Volume error (Master@card1):", e)
                 self.last_pot_check = now_ts
 
             # snooze short/long handling
@@ -904,18 +1140,17 @@ class Display:
                 self.snooze_short = False
                 if self.current_state == State.ALARM:
                     self.stop_alarm_playback()
-                    self.alarm.snooze()
+                    self.ringing.snooze()
                     self.current_state = State.CLOCK
                     self.render()
             if self.snooze_long:
                 self.snooze_long = False
+                snoozed = self.alarms.snoozed()
                 if self.current_state == State.ALARM or (
-                    self.alarm.is_snoozed() and self.current_state == State.CLOCK
+                    snoozed is not None and self.current_state == State.CLOCK
                 ):
                     self.stop_alarm_playback()
-                    self.alarm.snooze_until = None
-                    self.alarm.just_dismissed=datetime.now()
-                    self.alarm.save()
+                    (self.ringing if self.current_state == State.ALARM else snoozed).dismiss()
 
                     alarm_off_time = datetime.now()
                     self.current_state = State.ALARM_OFF
@@ -923,27 +1158,32 @@ class Display:
                     self.sunrise_started = False
                     self.render()
 
-            # alarm trigger
-            if self.current_state == State.CLOCK and self.alarm.should_trigger():
-                self.current_state = State.ALARM
-                self.start_alarm_playback()
-                self.render()
-                self.alarm.alarm_triggered()
-            
-            #sunrise trigger
-            if self.alarm.should_start_sunrise(now) and not self.sunrise_started:
-                self.sunrise_started = True
-                self.sunrise_triggered = True
-                self.sunrise_cancelled = False  # reset in case light was switched off before
-                duration = self.alarm.sunrise_minutes*60
-                def sunrise_worker():
-                    time.sleep(5)
-                    sunrise_effect(duration, cancel_fn=self.sunrise_cancelled_check)
-                
-                threading.Thread(target=sunrise_worker, daemon=True).start()
+            # alarm deadlines are precomputed and queued by AlarmSet, only the ones that passed are checked
+            for due in self.alarms.due(now_ts):
+                # alarm trigger
+                if self.current_state == State.CLOCK and due.should_trigger(now_ts):
+                    self.ringing = due
+                    self.current_state = State.ALARM
+                    self.start_alarm_playback(due)
+                    self.render()
+                    due.alarm_triggered()
+
+                #sunrise trigger
+                if due.should_start_sunrise(now_ts):
+                    self.sunrise_started = True
+                    self.sunrise_triggered = True
+                    self.sunrise_cancel.clear()  # reset in case light was switched off before
+                    # ends when the alarm goes off, even if it starts late or the bulb is slow
+                    end_at = now_ts + due.sunrise_started(now_ts)
+                    def sunrise_worker():
+                        if self.sunrise_cancel.wait(5):
+                            return
+                        sunrise_effect(end_at=end_at, cancel_event=self.sunrise_cancel)
+
+                    threading.Thread(target=sunrise_worker, daemon=True).start()
 
             # blink Zzz
-            if self.alarm.is_snoozed() or self.current_state == State.ALARM:
+            if self.alarms.snoozed() is not None or self.current_state == State.ALARM:
                 if (now - self.last_blink).total_seconds() >= 0.5:
                     self.blink_state = not self.blink_state
                     self.last_blink  = now
@@ -985,7 +1225,7 @@ class Display:
 
             # minute tick
             if now.minute != last_minute and self.current_state == State.CLOCK:
-                self.display_partial(self.draw_clock())
+                self.render()
                 last_minute = now.minute
 
             # buffered rotary handling
@@ -1003,6 +1243,12 @@ class Display:
                     else:
                         max_i = min(7,len(self.spotify.playlists) - 1)
                         self.sp_index = max(0, min(max_i, self.sp_index + delta))
+                elif self.current_state == State.SELECT_ALARM:
+                    # the extra last row is "+ New Alarm"
+                    self.alarm_index = max(0, min(len(self.alarms), self.alarm_index + delta))
+                elif self.current_state == State.SET_DAYS:
+                    self.days_index = max(0, min(len(DAY_PRESETS) - 1, self.days_index + delta))
+                    self.alarm.set_weekdays(DAY_PRESETS[self.days_index][1])
                 elif self.current_state == State.SET_HOUR:
                     new_h = (self.alarm.hour + delta) % 24
                     self.alarm.set_time(new_h, self.alarm.minute)
@@ -1023,13 +1269,25 @@ class Display:
 
                 self.render()
 
+            # playlists couldn't be loaded and nothing is cached: fall back like a failed download
+            if self.playlist_load_failed:
+                self.playlist_load_failed = False
+                if self.current_state == State.SELECT_PL and not self.display_playlists:
+                    self.alarm.sound_type = "Classic"
+                    self.alarm.save()
+                    self.current_state = State.DOWNLOAD_FAILED
+                    self.download_failed_time = datetime.now()
+                    self.prev_state = None
+                    self.render()
+
             # download completion / cancellation
-            if getattr(self, 'download_thread', None):
+            if self.download_pid:
 
                 #cancel via long-press
                 if self.menu_long_press and self.current_state == State.DOWNLOAD_PL:
                     self.menu_long_press = False
-                    del self.download_thread
+                    self.spotify.cancel_download(self.download_pid)
+                    self.download_pid = None
                     self.alarm.sound_type = "Classic"
                     self.alarm.save()
                     self.current_state = State.DOWNLOAD_FAILED
@@ -1038,21 +1296,31 @@ class Display:
                     self.last_input = datetime.now()
                     self.render()
 
-                #otherwise wait for the thread to finish
-                elif not self.download_thread.is_alive():
-                    pid = self.alarm.playlist_id
-                    if not self.spotify.is_downloaded(pid):
-                        self.alarm.sound_type = "Classic"
-                        self.alarm.save()
-                        self.current_state = State.DOWNLOAD_FAILED
-                        self.download_failed_time = datetime.now()
-                    else:
-                        self.current_state = State.MENU
+                #the queue's progress is only looked at when it changed, and not more often than the panel can show it
+                elif self.spotify.download_updates.changed():
+                    progress = self.spotify.download_progress(self.download_pid)
+
+                    #done once the playlist is alarm-ready (its first tracks are in) or the queue is done with it,
+                    #the rest of the tracks keep downloading in the background
+                    if progress is None or (progress["ready"] and self.spotify.is_downloaded(self.download_pid)):
+                        pid = self.download_pid
+                        if not self.spotify.is_downloaded(pid):
+                            self.alarm.sound_type = "Classic"
+                            self.alarm.save()
+                            self.current_state = State.DOWNLOAD_FAILED
+                            self.download_failed_time = datetime.now()
+                        else:
+                            self.current_state = State.MENU
+
+                        self.download_pid = None
+                        self.prev_state    = None
+                        self.last_input = datetime.now()
+                        self.render()
 
-                    del self.download_thread
-                    self.prev_state    = None
-                    self.last_input = datetime.now()
-                    self.render()
+                    else:
+                        self.download_progress = progress
+                        if self.current_state == State.DOWNLOAD_PL:
+                            self.render()
 
             if self.menu_long_press:
                 self.menu_long_press = False
@@ -1064,7 +1332,10 @@ class Display:
                     self.render()
 
             schedule.run_pending()
-            time.sleep(0.05)
+
+            # sleep until the next thing can happen, input callbacks wake us early
+            self.plan_wakeups(last_full, alarm_off_time)
+            self.deadlines.wait()
 
 if __name__ == "__main__":
     disp = Display()
@@ -1073,7 +1344,10 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         pass
     finally:
+        disp.alarms.flush()   # write any batched settings changes before exiting
         disp.stop_alarm_playback()
+        disp.renderer.stop()
+        print("Display refreshes:", disp.panel.stats())
         disp.epd.sleep()
         disp.encoder.close()
         disp.button.close()
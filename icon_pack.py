@@ -0,0 +1,8 @@
+# icon_pack.py
+# generated by `python3 icons.py --build` from the bitmaps in icons.py, do not edit by hand
+
+ICONS = {
+    'bell': (32, 32, b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xfc?\xff\xff\xf8\x1f\xff\xff\xe0\x07\xff\xff\xc0\x03\xff\xff\x80\x01\xff\xff\x00\x00\xff\xfe\x00\x00\x7f\xfc\x00\x00?\xfc\x00\x00?\xfc\x00\x00?\xfc\x00\x00?\xfc\x00\x00?\xf8\x00\x00\x1f\xf0\x00\x00\x0f\xf0\x00\x00\x0f\xf0\x00\x00\x0f\xf0\x00\x00\x0f\xf0\x00\x00\x0f\xc0\x00\x00\x03\xc0\x00\x00\x03\xc0\x00\x00\x03\xff\xff\xff\xff\xff\xff\xff\xff\xff\xf8\x1f\xff\xff\xf8\x1f\xff\xff\xf8\x1f\xff\xff\xf8\x1f\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff', 1774950545),
+    'download': (24, 24, b'\xff\xff\xff\xff\x01\xff\xfc\x00\x7f\xf8|?\xf1\xff\x1f\xe7\xe7\xcf\xc7\xe7\xc7\xcf\xe7\xe7\x8f\xe7\xe3\x9f\xe7\xf3\x9f\xe7\xf3\x9f\xe7\xf3\x9c\xe73\x9efs\x8f$\xe3\xcf\x81\xe7\xc7\xc3\xc7\xe7\xe7\xcf\xf1\xff\x1f\xf8|?\xfc\x00\x7f\xff\x01\xff\xff\xff\xff\xff\xff\xff', 3262271579),
+    'sunrise': (32, 32, b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xfe\x7f\xff\xff\xfe\x7f\xff\xfe~~\x7f\xff?\xfc\xff\xe7\x9f\xf9\xe7\xf3\xf0\x0f\xcf\xf9\xc7\xe3\x9f\xff\x1f\xf8\xff<\x7f\xfe<\x98\xff\xff\x19\xf1\xff\xff\x8f\xf1\xff\xff\x8f\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\xff\xff\xff\xff\xf0\x00\x00\x0f\xf0\x00\x00\x0f', 3710862017),
+}
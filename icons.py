@@ -1,10 +1,87 @@
 # icons.py
 # simple bitmaps for the display icons
+# icons are drawn as lists of strings and registered once with register_icon(). each one is decoded a single time
+# into packed 1-bit bytes, and scaled variants are cached per size, so drawing a screen never re-parses them.
+# `python3 icons.py --build` stores the packed bytes in icon_pack.py, which then loads with no parsing at all
+
+import sys
+import zlib
+from functools import lru_cache
+from pathlib import Path
 
 from PIL import Image
 
-def get_bell_bitmap():
-    bell_data = [
+try:
+    from icon_pack import ICONS as _PACKED
+except ImportError:
+    _PACKED = {}
+
+_SOURCES = {}   # name -> (rows, ink character)
+
+
+def register_icon(name, rows, ink="1"):
+    """Register an icon drawn as strings. `ink` is the character that marks a black pixel."""
+    _SOURCES[name] = (rows, ink)
+    get_icon.cache_clear()
+
+
+def _checksum(rows, ink):
+    return zlib.crc32(("".join(rows) + ink).encode())
+
+
+def pack_icon(rows, ink):
+    """Decode string rows into PIL's packed mode '1' layout (msb first, rows padded to a byte, 1 = white)."""
+    width = len(rows[0])
+    pad   = -width % 8
+    data  = bytearray()
+    for row in rows:
+        bits = "".join("0" if c == ink else "1" for c in row) + "1" * pad
+        data += int(bits, 2).to_bytes((width + pad) // 8, "big")
+    return width, len(rows), bytes(data)
+
+
+def _packed(name):
+    rows, ink = _SOURCES[name]
+    stored = _PACKED.get(name)
+    # use the prebuilt bytes unless the strings were edited after the last build
+    if stored is not None and stored[3] == _checksum(rows, ink):
+        return stored[:3]
+    return pack_icon(rows, ink)
+
+
+@lru_cache(maxsize=None)
+def get_icon(name, size=None):
+    """
+    Return the icon as a mode '1' image, optionally scaled to size (w, h).
+    Images are cached and shared between callers, so paste them but don't draw on them.
+    """
+    if size is not None:
+        return get_icon(name).resize(size, Image.NEAREST)
+    width, height, data = _packed(name)
+    return Image.frombytes('1', (width, height), data)
+
+
+def build_icon_pack(path=None):
+    """Write the packed bytes of every registered icon to icon_pack.py."""
+    path = Path(path or Path(__file__).with_name("icon_pack.py"))
+    lines = [
+        "# icon_pack.py",
+        "# generated by `python3 icons.py --build` from the bitmaps in icons.py, do not edit by hand",
+        "",
+        "ICONS = {",
+    ]
+    for name in sorted(_SOURCES):
+        rows, ink = _SOURCES[name]
+        width, height, data = pack_icon(rows, ink)
+        lines.append(f"    {name!r}: ({width}, {height}, {data!r}, {_checksum(rows, ink)}),")
+    lines.append("}")
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+# --- icon bitmaps ------------------------------------------------------------
+
+register_icon("bell", ink="0", rows=[
     "11111111111111111111111111111111",
     "11111111111111111111111111111111",
     "11111111111111000011111111111111",
@@ -37,84 +114,82 @@ def get_bell_bitmap():
     "11111111111111111111111111111111",
     "11111111111111111111111111111111",
     "11111111111111111111111111111111",
-    ]
-    bell_bits = [int(bit) for row in bell_data for bit in row]
-    bell_img = Image.new('1', (32, 32), 1)
-    bell_img.putdata(bell_bits)
-    return bell_img
+])
+
+register_icon("download", ink="1", rows=[
+    "000000000000000000000000",
+    "000000001111111000000000",
+    "000000111111111110000000",
+    "000001111000001111000000",
+    "000011100000000011100000",
+    "000110000001100000110000",
+    "001110000001100000111000",
+    "001100000001100000011000",
+    "011100000001100000011100",
+    "011000000001100000001100",
+    "011000000001100000001100",
+    "011000000001100000001100",
+    "011000110001100011001100",
+    "011000011001100110001100",
+    "011100001101101100011100",
+    "001100000111111000011000",
+    "001110000011110000111000",
+    "000110000001100000110000",
+    "000011100000000011100000",
+    "000001111000001111000000",
+    "000000111111111110000000",
+    "000000001111111000000000",
+    "000000000000000000000000",
+    "000000000000000000000000",
+])
+
+register_icon("sunrise", ink="1", rows=[
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00000000000000011000000000000000",
+    "00000000000000011000000000000000",
+    "00000001100000011000000110000000",
+    "00000000110000000000001100000000",
+    "00011000011000000000011000011000",
+    "00001100000011111111000000110000",
+    "00000110001110000001110001100000",
+    "00000000111000000000011100000000",
+    "11000011100000000000000111000011",
+    "01100111000000000000000011100110",
+    "00001110000000000000000001110000",
+    "00001110000000000000000001110000",
+    "11111111111111111111111111111111",
+    "11111111111111111111111111111111",
+    "00000000000000000000000000000000",
+    "00000000000000000000000000000000",
+    "00001111111111111111111111110000",
+    "00001111111111111111111111110000",
+])
+
+
+# old helpers, kept for existing callers
+def get_bell_bitmap():
+    return get_icon("bell")
 
 def get_download_bitmap():
-    bitmap = [
-        "000000000000000000000000",
-        "000000001111111000000000",
-        "000000111111111110000000",
-        "000001111000001111000000",
-        "000011100000000011100000",
-        "000110000001100000110000",
-        "001110000001100000111000",
-        "001100000001100000011000",
-        "011100000001100000011100",
-        "011000000001100000001100",
-        "011000000001100000001100",
-        "011000000001100000001100",
-        "011000110001100011001100",
-        "011000011001100110001100",
-        "011100001101101100011100",
-        "001100000111111000011000",
-        "001110000011110000111000",
-        "000110000001100000110000",
-        "000011100000000011100000",
-        "000001111000001111000000",
-        "000000111111111110000000",
-        "000000001111111000000000",
-        "000000000000000000000000",
-        "000000000000000000000000",
-    ]
-    img = Image.new("1", (24, 24), 1)  # 1 = white background
-    pixels = img.load()
-    for y, row in enumerate(bitmap):
-        for x, bit in enumerate(row):
-            if bit == "1":
-                pixels[x, y] = 0  # 0 = black pixel
-    return img
+    return get_icon("download")
 
 def get_sunrise_bitmap():
-    sunrise_data = [
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00000000000000011000000000000000",
-        "00000000000000011000000000000000",
-        "00000001100000011000000110000000",
-        "00000000110000000000001100000000",
-        "00011000011000000000011000011000",
-        "00001100000011111111000000110000",
-        "00000110001110000001110001100000",
-        "00000000111000000000011100000000",
-        "11000011100000000000000111000011",
-        "01100111000000000000000011100110",
-        "00001110000000000000000001110000",
-        "00001110000000000000000001110000",
-        "11111111111111111111111111111111",
-        "11111111111111111111111111111111",
-        "00000000000000000000000000000000",
-        "00000000000000000000000000000000",
-        "00001111111111111111111111110000",
-        "00001111111111111111111111110000",
-    ]
-    sunrise_bits = [1-int(bit) for row in sunrise_data for bit in row]
-    sunrise_img = Image.new('1', (32, 32), 1)
-    sunrise_img.putdata(sunrise_bits)
-    return sunrise_img
+    return get_icon("sunrise")
+
 
+if __name__ == "__main__":
+    if "--build" in sys.argv:
+        print(f"Wrote {build_icon_pack()}")
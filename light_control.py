@@ -1,129 +1,439 @@
 #!/usr/bin/env python3
-# this is the light control file. it handles all communication with the shelly rgbw2 light controller over http requests
-# you may need to adjust the shelly ip address below to match your local network setup
+# this is the light control file. it handles all communication with the shelly rgbw2 light controllers
+# you may need to adjust the shelly ip addresses below to match your local network setup
+# requests go through LightClient, which keeps one connection open (see light_transport.py) and never blocks the caller.
+# all bulbs in SHELLY_IPS are driven together as one LightGroup
 
-import requests
 import time
 import threading
 
-# Shelly IP and settings
-SHELLY_IP = "192.168.178.28"
-BASE_URL = f"http://{SHELLY_IP}/light/0"
+from light_transport import TransportError, make_transport
+
+# Shelly IPs and settings
+## one entry per bulb, either "ip" or ("ip", timeout in seconds[, transport]) for a bulb on a slower link
+## or with different firmware
+SHELLY_IPS = ["192.168.178.28"]
+SHELLY_TIMEOUT = 2
+## "http" works with every shelly, "ws" keeps a websocket json-rpc channel open (newer firmware)
+LIGHT_TRANSPORT = "http"
 
 # Warm orange tone - this is used for the sunrise effect but might be different for your bulb
 WARM_ORANGE = (255, 20, 2)
-current_gain = 15
+DEFAULT_GAIN = 15
+
+# --- bulb client ---------------------------------------------------------------
+## keeps one connection per bulb and a worker thread that does the actual requests.
+## callers only hand over the state they want, if several arrive while a request is in flight only the
+## newest one is sent, so gpiozero callbacks never wait on the network and fast encoder turns don't pile up.
+## every client mirrors what its bulb is doing: the status the shelly returns after each command, refreshed by a
+## status poll whenever the bulb has been quiet for a while (backing off while it can't be reached).
+## a command that wouldn't change the mirrored state is not sent at all
+
+# command parameters the mirror keeps track of
+STATE_KEYS = ("turn", "mode", "brightness", "temp", "red", "green", "blue")
+# status poll while the bulb answers, doubling up to the max while it doesn't
+POLL_INTERVAL     = 30
+POLL_MAX_INTERVAL = 300
+# a command that fails (timeout, dropped, rate limited) is tried again this often, unless a newer one replaced it
+COMMAND_RETRIES = 2
+RETRY_DELAY     = 0.3
+
+def status_to_state(status):
+    # /light/0 status json -> the command parameters that would produce it
+    state = {k: status[k] for k in STATE_KEYS if k in status}
+    if "ison" in status:
+        state["turn"] = "on" if status["ison"] else "off"
+    return state
+
+class LightClient:
+    def __init__(self, ip, timeout=2, transport=LIGHT_TRANSPORT):
+        self.ip       = ip
+        self.timeout  = timeout
+        self.transport = make_transport(transport, ip, timeout)
+        self._cond    = threading.Condition()
+        self._pending = None          # (params, tag) waiting to be sent
+        self._inflight = None         # params of the request being sent
+        self._busy    = False
+        self._closed  = False
+        self._retries = 0             # times the pending command has been retried
+        self._not_before = 0.0        # a retried command waits for this monotonic time
+        self.confirmed = {}           # bulb state from its last answer, empty = unknown
+        self.poll_interval = POLL_INTERVAL
+        self._next_poll = time.monotonic()   # first poll right away fills the mirror
+        # stats
+        self.sent      = 0
+        self.coalesced = 0            # commands replaced by a newer one before they were sent
+        self.skipped   = 0            # commands the bulb was already doing
+        self.retried   = 0
+        self.polls     = 0
+        self.rtt       = None         # smoothed request round trip time in seconds
+        self.ok        = None         # whether the last request went through, None = nothing sent yet
+        self.transitions = None       # firmware fades on its own (transition parameter), None = not asked yet
+        self._thread = threading.Thread(target=self._run, name=f"light-{ip}", daemon=True)
+        self._thread.start()
+
+    def set(self, params, tag="set"):
+        """Queue the desired state without blocking, replacing anything not sent yet.
+        Nothing is queued if the bulb will already be in that state."""
+        with self._cond:
+            if self._matches(params):
+                self.skipped += 1
+                return
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (params, tag)
+            self._retries = 0
+            self._not_before = 0.0
+            self._cond.notify()
+
+    def send(self, params, tag="send"):
+        """Send right away on the caller's thread (shares the connection). Returns True on success."""
+        return self._request(params, tag)
+
+    def state(self):
+        """The state the bulb is in once everything queued has been sent, {} if unknown."""
+        with self._cond:
+            return self._expected()
+
+    def _expected(self):
+        # lock held: confirmed state with the request in flight and the pending one applied on top
+        state = dict(self.confirmed)
+        for params in (self._inflight, self._pending and self._pending[0]):
+            if params:
+                state.update((k, v) for k, v in params.items() if k in STATE_KEYS)
+        return state
+
+    def _matches(self, params):
+        state = self._expected()
+        return all(state.get(k) == v for k, v in params.items() if k in STATE_KEYS)
+
+    def supports_transitions(self):
+        """Ask the bulb once whether its firmware knows the transition parameter. False if it can't be reached."""
+        if self.transitions is None:
+            try:
+                self.transitions = self.transport.supports_transitions()
+            except TransportError as e:
+                # not cached, ask again next time
+                print(f"[light_control.supports_transitions] Error: {e}")
+                return False
+        return self.transitions
+
+    def wait_idle(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _request(self, params, tag):
+        # params None only asks for the status
+        start = time.monotonic()
+        try:
+            status = self.transport.request(params)
+        except TransportError as e:
+            print(f"[light_control.{tag}] {self.ip} Error: {e}")
+            with self._cond:
+                # the bulb may or may not have taken it, make the next command go out regardless
+                self.confirmed = {}
+            self.ok = False
+            return False
+        finally:
+            self.sent += 1
+        elapsed = time.monotonic() - start
+        self.rtt = elapsed if self.rtt is None else 0.8 * self.rtt + 0.2 * elapsed
+        self.ok = True
+        # every transport answers with the bulb's status
+        state = status_to_state(status)
+        if not state and params:
+            state = {k: v for k, v in params.items() if k in STATE_KEYS}
+        with self._cond:
+            if params is None:
+                self.confirmed = state
+            else:
+                self.confirmed.update(state)
+        return True
+
+    def close(self):
+        # stops the worker once the request in flight is done
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify_all()
+        self.transport.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    until = self._next_poll if self._pending is None else self._not_before
+                    wait = until - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._closed:
+                    return
+                if self._pending is None:
+                    params, tag = None, "poll"
+                    self.polls += 1
+                else:
+                    params, tag = self._pending
+                    self._pending = None
+                self._inflight = params
+                self._busy = True
+            ok = self._request(params, tag)
+            with self._cond:
+                self._inflight = None
+                self._busy = False
+                if ok:
+                    self.poll_interval = POLL_INTERVAL
+                elif params is None:
+                    self.poll_interval = min(POLL_MAX_INTERVAL, self.poll_interval * 2)
+                elif self._pending is None and self._retries < COMMAND_RETRIES:
+                    # otherwise the last command of a sunrise or an encoder turn could be lost for good
+                    self._pending = (params, tag)
+                    self._retries += 1
+                    self._not_before = time.monotonic() + RETRY_DELAY
+                    self.retried += 1
+                # any answer is a fresh status, the next poll counts from here
+                self._next_poll = time.monotonic() + self.poll_interval
+                self._cond.notify_all()
+
+# --- bulb group ----------------------------------------------------------------
+## every bulb has its own LightClient (connection, worker thread, timeout), so a command reaches all of them
+## at the same moment and a bulb that doesn't answer only holds up its own worker, never the others
+
+class LightGroup:
+    def __init__(self, bulbs, timeout=SHELLY_TIMEOUT, transport=LIGHT_TRANSPORT):
+        self.clients = []
+        for bulb in bulbs:
+            ip, *rest = (bulb,) if isinstance(bulb, str) else bulb
+            rest += (timeout, transport)[len(rest):]
+            self.clients.append(LightClient(ip, *rest[:2]))
+
+    def is_on(self):
+        """True if any bulb is (or is about to be) on, according to the mirrors."""
+        return any(c.state().get("turn") == "on" for c in self.clients)
+
+    def is_white(self):
+        """True if any bulb is (or is about to be) on in white mode, a sunrise runs in colour mode."""
+        return any(c.state().get("turn") == "on" and c.state().get("mode") == "white" for c in self.clients)
+
+    @property
+    def gain(self):
+        # white mode brightness from the first bulb that is on in white mode
+        for c in self.clients:
+            state = c.state()
+            if state.get("turn") == "on" and state.get("mode") == "white" and "brightness" in state:
+                return state["brightness"]
+        return DEFAULT_GAIN
+
+    def set(self, params, tag="set"):
+        """Queue the state on every bulb without blocking."""
+        for c in self.clients:
+            c.set(params, tag)
+
+    def send(self, params, tag="send"):
+        """Send to all bulbs at once and wait until each has answered or timed out. True if all succeeded."""
+        self.set(params, tag)
+        for c in self.clients:
+            c.wait_idle(c.timeout + 1)
+        return all(c.ok for c in self.clients)
+
+    @property
+    def rtt(self):
+        # pace shared effects by the slowest bulb that still answers, a dead one would only slow everyone down
+        rtts = [c.rtt for c in self.clients if c.rtt is not None and c.ok is not False]
+        return max(rtts) if rtts else None
+
+    def supports_transitions(self):
+        """True if every bulb that can be reached fades on its own. Bulbs are asked in parallel."""
+        threads = [threading.Thread(target=c.supports_transitions, daemon=True)
+                   for c in self.clients if c.transitions is None]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        known = [c.transitions for c in self.clients if c.transitions is not None]
+        return bool(known) and all(known)
+
+    def wait_idle(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        return all(c.wait_idle(None if end is None else max(0.0, end - time.monotonic())) for c in self.clients)
+
+    def close(self):
+        for c in self.clients:
+            c.close()
+
+# the bulb group is made on first use (or by configure), so importing this module starts no threads
+# and talks to no bulb
+lights = None
+_lights_lock = threading.Lock()
+
+def get_lights():
+    """The bulb group, created from SHELLY_IPS the first time it's needed."""
+    global lights
+    with _lights_lock:
+        if lights is None:
+            lights = LightGroup(SHELLY_IPS)
+        return lights
+
+def configure(bulbs, timeout=SHELLY_TIMEOUT, transport=LIGHT_TRANSPORT):
+    """Replace the bulb group, bulbs as in SHELLY_IPS."""
+    global lights
+    with _lights_lock:
+        old, lights = lights, LightGroup(bulbs, timeout, transport)
+    if old is not None:
+        old.close()
+    return lights
 
 # turn on light
 def turn_on():
-    try:
-        resp= requests.get(
-            BASE_URL,
-            params={
-                "turn": "on",
-                "mode": "white",
-                "temp": 3000,
-                "brightness": 15
-            }, 
-            timeout=2
-        )
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"[light_control.turn_on] Error: {e}")
+    get_lights().set({
+        "turn": "on",
+        "mode": "white",
+        "temp": 3000,
+        "brightness": DEFAULT_GAIN
+    }, "turn_on")
 
 # turn off light
 def turn_off():
-    try:
-        resp = requests.get(BASE_URL, params={"turn": "off"}, timeout=2)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"[light_control.turn_off] Error: {e}")
+    get_lights().set({"turn": "off"}, "turn_off")
 
 # change brightness in white mode
 def set_brightness(gain):
-    global current_gain
     gain = max(1, min(100, gain))  # Clamp between 1 and 100
-    current_gain = gain
-    try:
-        resp = requests.get(
-            BASE_URL, 
-            params={
-                "turn": "on",
-                "mode": "white",
-                "temp": 3000,
-                "brightness": gain
-            }, 
-            timeout=2
-        )
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"[light_control.set_brightness] Error: {e}")
+    get_lights().set({
+        "turn": "on",
+        "mode": "white",
+        "temp": 3000,
+        "brightness": gain
+    }, "set_brightness")
 
 # set RGB color and brightness (used for sunrise effect)
-def set_rgb_brightness(rgb, brightness):
-    """Send an HTTP request to set the RGB color and brightness (gain)"""
-    try:
-        resp=requests.get(
-            BASE_URL,
-            params={
-                "turn": "on",
-                "mode": "color",
-                "red": rgb[0],
-                "green": rgb[1],
-                "blue": rgb[2],
-                "brightness": brightness
-            }, 
-            timeout=2
-        )
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"[set_rgb_brightness] Error: {e}")
+def set_rgb_brightness(rgb, brightness, transition=None):
+    """Queue the RGB color and brightness (gain), only the newest value is sent if the bulb is slow.
+    transition (ms) lets the bulb fade to the new value itself."""
+    params = {
+        "turn": "on",
+        "mode": "color",
+        "red": rgb[0],
+        "green": rgb[1],
+        "blue": rgb[2],
+        "brightness": brightness
+    }
+    if transition is not None:
+        params["transition"] = transition
+    get_lights().set(params, "set_rgb_brightness")
 
 # sunrise effect implementation
 ## sets a sunrise over a specified duration by gradually changing color and brightness
-## if the duration is too short the effect may cause erros with too many requests in a short time
+## the color is worked out from the time elapsed against a fixed monotonic end, so slow or failed requests
+## never stretch the effect: it ends at end_at whatever the wifi does. steps are paced by the bulb's measured
+## round trip time, steps that wouldn't change the light are not sent, and setting cancel_event stops it at once
+## with firmware that supports it the pi only sends a few keyframes and the bulb fades between them on its own
+
+SUNRISE_START = (255, 15, 0, 5)     # r, g, b, brightness
+SUNRISE_END   = (255, 80, 2, 100)
+# never step faster than this, the shelly errors out with too many requests in a short time
+MIN_STEP_SECONDS = 0.5
+# a step waits for this many round trips so the bulb is never sent more than it can take
+RTT_STEP_FACTOR  = 2
+
+# "transition": keyframes the bulb fades between, "steps": every step sent from the pi,
+# "auto": transition if the bulb's firmware has the transition parameter, steps otherwise
+SUNRISE_MODE      = "auto"
+SUNRISE_KEYFRAMES = 16
+# longest fade the shelly gen1 firmware accepts, longer keyframe gaps fade for this long and then hold
+MAX_TRANSITION_MS = 5000
+
+def sunrise_color(progress):
+    """(r, g, b, brightness) at progress 0..1 of the sunrise, as whole numbers the bulb accepts"""
+    return tuple(int(a + (b - a) * progress) for a, b in zip(SUNRISE_START, SUNRISE_END))
+
+def _step_sunrise(start, end, cancel_event, cancelled):
+    last  = None
+    next_step = start
+    while True:
+        if cancelled():
+            return False
 
-def sunrise_effect(duration_seconds=600, cancel_fn = None):
+        now = time.monotonic()
+        progress = 1.0 if now >= end else (now - start) / (end - start)
+        color = sunrise_color(progress)
+        if color != last:
+            # non-blocking, a step the bulb hasn't taken yet is replaced by this one
+            set_rgb_brightness(color[:3], color[3])
+            last = color
+        if progress >= 1.0:
+            return True
+
+        step = max(MIN_STEP_SECONDS, RTT_STEP_FACTOR * (get_lights().rtt or 0))
+        next_step += step
+        if next_step < now:
+            # fell behind (slow request, busy cpu), carry on from now instead of bursting to catch up
+            next_step = now + step
+        # always land a step exactly on the end
+        next_step = min(next_step, end)
+        if cancel_event.wait(max(0.0, next_step - time.monotonic())):
+            return False
+
+def _keyframe_sunrise(start, end, cancel_event, cancelled):
+    # keyframe k is reached at start + k/n of the duration: it's sent one fade (plus half a round trip)
+    # before that, so the bulb's fade ends right on the curve and the last one ends at the alarm
+    n = max(1, SUNRISE_KEYFRAMES)
+    gap  = (end - start) / n
+    fade = min(gap, MAX_TRANSITION_MS / 1000)
+    for k in range(1, n + 1):
+        at = start + gap * k
+        send_at = at - fade - (get_lights().rtt or 0) / 2
+        if cancel_event.wait(max(0.0, send_at - time.monotonic())) or cancelled():
+            return False
+        # running late shortens the fade instead of moving the keyframe
+        fade_ms = int(max(0.0, at - time.monotonic()) * 1000)
+        color = sunrise_color(k / n)
+        set_rgb_brightness(color[:3], color[3], transition=min(fade_ms, MAX_TRANSITION_MS))
+    return True
+
+def sunrise_effect(duration_seconds=600, cancel_fn=None, cancel_event=None, end_at=None, mode=None):
+    """
+    Run the sunrise until end_at (time.time() timestamp) or for duration_seconds.
+    mode overrides SUNRISE_MODE. Returns True if it ran to the end, False if it was cancelled
+    through cancel_event or cancel_fn.
+    """
     print("Sunrise effect started")
-    steps = 80
-    delay = duration_seconds / steps
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    if end_at is not None:
+        duration_seconds = max(0.0, end_at - time.time())
+    # fix the end before anything touches the network
+    start = time.monotonic()
+    end   = start + duration_seconds
 
-    start_r, start_g, start_b, start_br = 255, 15, 0, 5
-    end_r, end_g, end_b, end_br = 255, 80, 2, 100
+    def cancelled():
+        return cancel_event.is_set() or (cancel_fn is not None and cancel_fn())
 
     # Force Shelly into known initial state to avoid flashing
-    try:
-        requests.get(BASE_URL, params={
-            "turn": "on",
-            "mode": "color",
-            "red": 255,
-            "green": 15,
-            "blue": 0,
-            "brightness": 1
-        }, timeout=2)
-    except Exception as e:
-        print(f"[sunrise_effect prep] Error: {e}")
-
-    time.sleep(0.1)  # small delay to avoid clashing with the loop
-
-    for i in range(1, steps + 1):
-
-        if cancel_fn and cancel_fn():
-            print("Sunrise cancelled")
-            break
-
-
-        progress = i/steps
-        r = 255
-        g = int(start_g + (end_g - start_g) * progress)
-        b = int(start_b + (end_b - start_b) * progress)
-        br = int(start_br + (end_br - start_br) * progress)
-        set_rgb_brightness([r,g,b],br)
-        time.sleep(delay)
+    # queued like the steps, so each bulb gets it before its first step and a dead bulb holds up nobody
+    get_lights().set({
+        "turn": "on",
+        "mode": "color",
+        "red": SUNRISE_START[0],
+        "green": SUNRISE_START[1],
+        "blue": SUNRISE_START[2],
+        "brightness": 1
+    }, "sunrise_effect prep")
+
+    mode = mode or SUNRISE_MODE
+    if mode == "auto":
+        mode = "transition" if get_lights().supports_transitions() else "steps"
+    engine = _keyframe_sunrise if mode == "transition" else _step_sunrise
+    if engine(start, end, cancel_event, cancelled):
+        return True
+    print("Sunrise cancelled")
+    return False
 
 ##for threading support
-def run_sunrise_thread(duration_seconds=600):
+def run_sunrise_thread(duration_seconds=600, cancel_event=None, end_at=None, mode=None):
     """Trigger the sunrise effect as a background thread"""
-    thread = threading.Thread(target=sunrise_effect, args=(duration_seconds,))
+    thread = threading.Thread(target=sunrise_effect, args=(duration_seconds,),
+                              kwargs={"cancel_event": cancel_event, "end_at": end_at, "mode": mode})
     thread.daemon = True
     thread.start()
+    return thread
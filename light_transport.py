@@ -0,0 +1,337 @@
+# light_transport.py
+# how light_control talks to a bulb. every transport takes the same command parameters (the shelly gen1
+# /light/0 query: turn, mode, brightness, temp, red, green, blue, transition) and returns the bulb's status
+# afterwards in the gen1 shape (ison, mode, brightness, ...), so light_control doesn't care which one is used
+#   http - a GET per command over a keep-alive session. this is the gen1 api of the shelly bulb / bulb rgbw
+#          (and every gen1 device with a /light/0 that takes mode, red/green/blue and temp)
+#   ws   - one persistent websocket carrying json-rpc 2.0 (gen2+ firmware, ws://<ip>/rpc), no per-request
+#          http overhead. the websocket client is written against the socket module, so nothing extra to install
+# gen2+ devices have no single light with modes, they expose components instead: rgb / rgbw (colour),
+# cct (tunable white) and light (plain dimmer), each with its own <Type>.Set. the ws transport finds out
+# which ones the device has with Shelly.GetStatus and sends colour commands to rgbw or rgb, white ones to
+# cct, rgbw (white channel) or light. this follows the published gen2+ rpc api and is tested against
+# shelly_sim.py, which models a device with an rgb and a cct component
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+
+import requests
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class TransportError(Exception):
+    pass
+
+
+def split_host(ip, default_port=80):
+    # "192.168.178.28" or "127.0.0.1:8080"
+    host, _, port = ip.partition(":")
+    return host, int(port) if port else default_port
+
+
+# --- http ------------------------------------------------------------------------
+
+class HttpTransport:
+    name = "http"
+
+    def __init__(self, ip, timeout=2):
+        self.base_url = f"http://{ip}/light/0"
+        self.settings_url = f"http://{ip}/settings/light/0"
+        self.timeout  = timeout
+        self.session  = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+    def request(self, params=None):
+        """Send params (None: just ask) and return the status the bulb answers with."""
+        try:
+            resp = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            raise TransportError(e) from e
+        try:
+            return resp.json()
+        except ValueError:
+            return {}
+
+    def supports_transitions(self):
+        try:
+            resp = self.session.get(self.settings_url, timeout=self.timeout)
+            resp.raise_for_status()
+            return "transition" in resp.json()
+        except (requests.RequestException, ValueError) as e:
+            raise TransportError(e) from e
+
+    def close(self):
+        self.session.close()
+
+
+# --- websocket frames (rfc 6455), shared with the stand-in server in shelly_sim.py ---
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("websocket closed")
+        data += chunk
+    return data
+
+
+def send_frame(sock, payload, opcode=0x1, mask=True):
+    # clients must mask what they send, servers must not
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header += bytes([mask_bit | length])
+    elif length < 1 << 16:
+        header += bytes([mask_bit | 126]) + struct.pack("!H", length)
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack("!Q", length)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    sock.sendall(header + payload)
+
+
+def recv_frame(sock):
+    """Return (opcode, payload) of the next frame. Fragmented messages are not used by the shelly."""
+    b0, b1 = recv_exact(sock, 2)
+    length = b1 & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", recv_exact(sock, 8))[0]
+    key = recv_exact(sock, 4) if b1 & 0x80 else None
+    payload = recv_exact(sock, length)
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return b0 & 0x0F, payload
+
+
+# --- json-rpc over websocket -------------------------------------------------------
+
+# component type -> rpc namespace, and which types can show a mode, preferred first
+RPC_NAMES = {"rgb": "RGB", "rgbw": "RGBW", "cct": "CCT", "light": "Light"}
+COLOR_TYPES = ("rgbw", "rgb")
+WHITE_TYPES = ("cct", "rgbw", "light")
+
+
+def find_components(status):
+    # Shelly.GetStatus result -> {component type: id} of the light components, lowest id of each type
+    found = {}
+    for key in status:
+        kind, _, cid = key.partition(":")
+        if kind in RPC_NAMES and cid.isdigit():
+            found[kind] = min(int(cid), found.get(kind, int(cid)))
+    return found
+
+
+def command_mode(params):
+    # "color", "white", or None for commands that don't pick one (turning off)
+    if "mode" in params:
+        return params["mode"]
+    if any(k in params for k in ("red", "green", "blue")):
+        return "color"
+    if "temp" in params:
+        return "white"
+    return None
+
+
+def to_rpc(params, components):
+    """gen1 query -> [(method, arguments)]: a Set on the component for the mode, or on all of them without one."""
+    mode = command_mode(params)
+    if mode is None:
+        kinds = list(components)
+    else:
+        kind = next((k for k in (COLOR_TYPES if mode == "color" else WHITE_TYPES) if k in components), None)
+        if kind is None:
+            raise TransportError(f"no component for {mode} mode, the device has {sorted(components) or 'none'}")
+        kinds = [kind]
+    calls = []
+    for kind in kinds:
+        args = {"id": components[kind]}
+        if "turn" in params:
+            args["on"] = params["turn"] == "on"
+        if "brightness" in params:
+            args["brightness"] = params["brightness"]
+        if "transition" in params:
+            args["transition_duration"] = params["transition"] / 1000
+        if mode == "color":
+            args["rgb"] = [params.get("red", 0), params.get("green", 0), params.get("blue", 0)]
+            if kind == "rgbw":
+                args["white"] = 0
+        elif mode == "white":
+            if kind == "cct" and "temp" in params:
+                args["ct"] = params["temp"]
+            elif kind == "rgbw":
+                args["rgb"] = [0, 0, 0]
+                args["white"] = 255
+        calls.append((f"{RPC_NAMES[kind]}.Set", args))
+    return calls
+
+
+def from_rpc(status):
+    # Shelly.GetStatus result -> gen1 status of the component that is on (only "ison" when none is)
+    out = {"ison": False}
+    for key, comp in status.items():
+        kind = key.partition(":")[0]
+        if kind not in RPC_NAMES or not isinstance(comp, dict) or not comp.get("output"):
+            continue
+        out["ison"] = True
+        if "brightness" in comp:
+            out["brightness"] = comp["brightness"]
+        rgb = comp.get("rgb")
+        if kind == "rgb" or (kind == "rgbw" and rgb and any(rgb)):
+            out["mode"] = "color"
+            out["red"], out["green"], out["blue"] = rgb
+        else:
+            out["mode"] = "white"
+            if "ct" in comp:
+                out["temp"] = comp["ct"]
+        break
+    return out
+
+
+class WebSocketTransport:
+    name = "ws"
+
+    def __init__(self, ip, timeout=2):
+        self.host, self.port = split_host(ip)
+        self.timeout = timeout
+        self._sock = None
+        self._ids  = 0
+        self._components = None     # {type: id} from Shelly.GetStatus, looked up once
+        self._lit = set()           # component types last turned on, switched off when another takes over
+        # the client worker and a blocking send() may share the connection
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall((
+            f"GET /rpc HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = sock.recv(1024)
+            if not chunk:
+                raise ConnectionError("websocket handshake closed")
+            head += chunk
+        status, *lines = head.split(b"\r\n\r\n", 1)[0].decode(errors="replace").split("\r\n")
+        # header names are case-insensitive, and the value may come with extra whitespace
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status.split()[1:2] != ["101"] or headers.get("sec-websocket-accept") != accept_key(key):
+            sock.close()
+            raise ConnectionError(f"websocket handshake refused: {status}")
+        return sock
+
+    def call(self, method, params=None):
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                self._ids += 1
+                msg = {"jsonrpc": "2.0", "id": self._ids, "src": "epaper-alarm", "method": method}
+                if params is not None:
+                    msg["params"] = params
+                send_frame(self._sock, json.dumps(msg).encode())
+                while True:
+                    opcode, payload = recv_frame(self._sock)
+                    if opcode == 0x9:                         # ping
+                        send_frame(self._sock, payload, opcode=0xA)
+                        continue
+                    if opcode == 0x8:
+                        raise ConnectionError("websocket closed by bulb")
+                    if opcode != 0x1:
+                        continue
+                    reply = json.loads(payload)
+                    # notifications (no id) and stale replies are skipped
+                    if reply.get("id") == self._ids:
+                        break
+            except (OSError, ValueError) as e:
+                self._drop()
+                raise TransportError(e) from e
+        if "error" in reply:
+            raise TransportError(reply["error"])
+        return reply.get("result") or {}
+
+    def _status(self):
+        status = self.call("Shelly.GetStatus")
+        components = find_components(status)
+        if not components:
+            raise TransportError("device has no rgb, rgbw, cct or light component")
+        self._components = components
+        self._lit = {key.partition(":")[0] for key, comp in status.items()
+                     if key.partition(":")[0] in components and isinstance(comp, dict) and comp.get("output")}
+        return status
+
+    def request(self, params=None):
+        if not params:
+            return from_rpc(self._status())
+        if self._components is None:
+            self._status()
+        calls = to_rpc(params, self._components)
+        kinds = {method.partition(".")[0].lower() for method, _ in calls}
+        turning_on = params.get("turn") == "on"
+        if turning_on:
+            # a device with separate colour and white outputs: the one that was on goes off after the switch
+            calls += [(f"{RPC_NAMES[k]}.Set", {"id": self._components[k], "on": False}) for k in self._lit - kinds]
+        for method, args in calls:
+            self.call(method, args)
+        if turning_on:
+            self._lit = kinds
+        elif params.get("turn") == "off":
+            self._lit -= kinds
+        # Set answers with null, an empty status makes the client mirror what it sent
+        # instead of spending a second round trip on Shelly.GetStatus
+        return {}
+
+    def supports_transitions(self):
+        # transition_duration is part of every component's Set, this only checks the device answers
+        # and has a light component
+        self._status()
+        return True
+
+    def _drop(self):
+        # reconnect on the next call
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+
+TRANSPORTS = {
+    HttpTransport.name:      HttpTransport,
+    WebSocketTransport.name: WebSocketTransport,
+}
+
+
+def make_transport(name, ip, timeout=2):
+    try:
+        return TRANSPORTS[name](ip, timeout)
+    except KeyError:
+        raise ValueError(f"unknown light transport {name!r}, choose from {sorted(TRANSPORTS)}") from None
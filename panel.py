@@ -0,0 +1,176 @@
+# panel.py
+# thin layer over the waveshare epd3in7 driver that only pushes the parts of a frame that changed
+# the driver always writes the whole 280x480 ram before a partial refresh. here the new buffer is compared with
+# the last one sent and only the changed windows are written, using the controller's ram window commands
+# frames are packed with numpy straight into one of two preallocated buffers, which replaces
+# img.rotate(180) + epd.getbuffer() (a full copy plus a per-pixel loop in python) on every update
+# frames that are pixel-identical to the last one sent are dropped before any spi traffic, using a short hash
+
+import hashlib
+
+import numpy as np
+
+# ram window commands of the epd3in7 controller (see the init sequence in epd3in7.py)
+_SET_RAM_X_WINDOW  = 0x44
+_SET_RAM_Y_WINDOW  = 0x45
+_SET_RAM_X_COUNTER = 0x4E
+_SET_RAM_Y_COUNTER = 0x4F
+_WRITE_RAM_BW      = 0x24
+_MASTER_ACTIVATION = 0x20
+
+# rows closer together than this are merged into one window, every window costs a few command bytes
+MERGE_GAP_ROWS = 8
+# more windows than this, or windows covering more of the panel than this, just send the whole frame
+MAX_WINDOWS     = 4
+MAX_WINDOW_AREA = 0.6
+
+
+def fingerprint(buf):
+    # 8 byte blake2b of the packed frame: tens of microseconds, and collisions are not a practical concern
+    return hashlib.blake2b(buf, digest_size=8).digest()
+
+
+def pack_frame(img, out):
+    """
+    Pack a landscape mode '1' frame (480x280, as drawn by final.py) into panel ram layout.
+    This is the same bit order the driver produces with getbuffer(img.rotate(180)):
+    a transposed, column-flipped view of the pixels, packed msb first, white = 1.
+    """
+    pixels = np.asarray(img, dtype=bool)
+    out[:] = np.packbits(pixels.T[:, ::-1], axis=1)
+
+
+def diff_windows(old, new, merge_gap=MERGE_GAP_ROWS):
+    """
+    Compare two packed frame buffers (rows x stride arrays) and return the changed areas as
+    (x0_byte, x1_byte, y0, y1) tuples, inclusive, in panel ram coordinates. Empty list when nothing changed.
+    """
+    changed = old != new
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return []
+    # split into bands wherever the gap between changed rows is bigger than merge_gap
+    splits = np.flatnonzero(np.diff(rows) > merge_gap) + 1
+    windows = []
+    for band in np.split(rows, splits):
+        y0, y1 = int(band[0]), int(band[-1])
+        cols = np.flatnonzero(changed[y0:y1+1].any(axis=0))
+        windows.append((int(cols[0]), int(cols[-1]), y0, y1))
+    return windows
+
+
+class Panel:
+    """
+    Owns the e-paper driver and a pair of packed frame buffers: front is what the panel ram holds,
+    back is where the next frame is packed. Partial updates only write the windows that differ and
+    fall back to the driver's full-frame partial update whenever windows can't be used or aren't worth it.
+    """
+
+    def __init__(self, epd):
+        self.epd    = epd
+        self.stride = epd.width // 8      # bytes per ram row (280 px)
+        self.rows   = epd.height          # ram rows (480)
+        self.front  = np.full((self.rows, self.stride), 0xFF, dtype=np.uint8)
+        self.back   = np.full((self.rows, self.stride), 0xFF, dtype=np.uint8)
+        self.front_valid = False          # False when the panel ram content is unknown
+        self.front_print = None           # fingerprint of the front buffer
+        self.can_window = all(hasattr(epd, n) for n in ("send_command", "send_data", "load_lut", "ReadBusy", "lut_1Gray_A2"))
+        # refresh counters, see stats()
+        self.full_updates    = 0
+        self.partial_updates = 0          # whole-frame partial updates
+        self.window_updates  = 0          # partial updates limited to changed windows
+        self.skipped         = 0          # identical frames that never reached the panel
+
+    def invalidate(self):
+        # ram content unknown (after init/reset), next partial sends the whole frame
+        self.front_valid = False
+        self.front_print = None
+
+    def clear(self, mode):
+        self.epd.Clear(0xFF, mode)
+        self.front.fill(0xFF)
+        self.front_valid = True
+        self.front_print = fingerprint(self.front)
+
+    def stats(self):
+        return {
+            "full":    self.full_updates,
+            "partial": self.partial_updates,
+            "windows": self.window_updates,
+            "skipped": self.skipped,
+        }
+
+    def _flip(self):
+        self.front, self.back = self.back, self.front
+
+    def _send_frame(self, buf):
+        # memoryview instead of the array: the driver does `image == None`, which numpy would broadcast
+        self.epd.display_1Gray(memoryview(buf.reshape(-1)))
+
+    def full(self, img):
+        # full refresh with the slow waveform, clears all ghosting
+        pack_frame(img, self.back)
+        self.epd.init(0); self.epd.Clear(0xFF, 0)
+        self._send_frame(self.back)
+        self.epd.init(1)
+        self._flip()
+        self.invalidate()
+        self.full_updates += 1
+
+    def partial(self, img):
+        """Show img with a partial refresh. Returns False if the frame was identical and nothing was sent."""
+        pack_frame(img, self.back)
+        back_print = fingerprint(self.back)
+        if self.front_valid and back_print == self.front_print:
+            self.skipped += 1
+            return False
+        if not self.front_valid or not self.can_window:
+            self._send_frame(self.back)
+            self.partial_updates += 1
+        else:
+            windows = diff_windows(self.front, self.back)
+            area = sum((x1-x0+1) * (y1-y0+1) for x0, x1, y0, y1 in windows)
+            if len(windows) > MAX_WINDOWS or area > MAX_WINDOW_AREA * self.stride * self.rows:
+                self._send_frame(self.back)
+                self.partial_updates += 1
+            else:
+                self._display_windows(self.back, windows)
+                self.window_updates += 1
+        self._flip()
+        self.front_valid = True
+        self.front_print = back_print
+        return True
+
+    # --- low level -----------------------------------------------------------
+
+    def _send_pair(self, cmd, a, b):
+        epd = self.epd
+        epd.send_command(cmd)
+        epd.send_data(a & 0xFF); epd.send_data(a >> 8)
+        epd.send_data(b & 0xFF); epd.send_data(b >> 8)
+
+    def _send_bulk(self, data):
+        if hasattr(self.epd, "send_data2"):
+            self.epd.send_data2(data)
+        else:
+            for byte in data:
+                self.epd.send_data(byte)
+
+    def _display_windows(self, buf, windows):
+        epd = self.epd
+        for x0, x1, y0, y1 in windows:
+            # x is addressed in pixels but the window is always byte aligned
+            self._send_pair(_SET_RAM_X_WINDOW, x0*8, x1*8 + 7)
+            self._send_pair(_SET_RAM_Y_WINDOW, y0, y1)
+            epd.send_command(_SET_RAM_X_COUNTER); epd.send_data((x0*8) & 0xFF); epd.send_data((x0*8) >> 8)
+            epd.send_command(_SET_RAM_Y_COUNTER); epd.send_data(y0 & 0xFF); epd.send_data(y0 >> 8)
+            epd.send_command(_WRITE_RAM_BW)
+            self._send_bulk(buf[y0:y1+1, x0:x1+1].tobytes())
+
+        # restore the full window so the driver's own display/clear calls keep working
+        self._send_pair(_SET_RAM_X_WINDOW, 0, self.stride*8 - 1)
+        self._send_pair(_SET_RAM_Y_WINDOW, 0, self.rows - 1)
+
+        epd.load_lut(epd.lut_1Gray_A2)
+        epd.send_command(_MASTER_ACTIVATION)
+        epd.ReadBusy()
@@ -0,0 +1,79 @@
+# render_worker.py
+# dedicated display thread so input handling and alarm logic never wait on the e-paper BUSY line
+# render requests go into a single slot: asking for a frame while one is already waiting doesn't queue another,
+# and because frames are drawn from the current state when the thread gets to them, the newest state always wins
+
+import threading
+import time
+
+
+class RenderWorker:
+    """
+    Runs draw_fn(full) on its own thread. request() never blocks.
+    A pending full refresh and a pending partial update are tracked separately, so a full refresh
+    can't swallow a screen change that was asked for at the same time.
+    """
+
+    def __init__(self, draw_fn):
+        self.draw_fn = draw_fn
+        self._cond   = threading.Condition()
+        self._full_pending    = False
+        self._partial_pending = False
+        self._busy    = False
+        self._running = True
+        # stats
+        self.frames    = 0
+        self.coalesced = 0       # requests folded into one that was already waiting
+        self.last_frame_time = 0.0
+        self.partial_time = 0.0  # smoothed time of partial frames, full refreshes are slow on purpose
+        self._thread = threading.Thread(target=self._run, name="render", daemon=True)
+        self._thread.start()
+
+    def request(self, full=False):
+        with self._cond:
+            if full:
+                self.coalesced += self._full_pending
+                self._full_pending = True
+            else:
+                self.coalesced += self._partial_pending
+                self._partial_pending = True
+            self._cond.notify()
+
+    def busy(self):
+        with self._cond:
+            return self._busy or self._full_pending or self._partial_pending
+
+    def stop(self, timeout=5.0):
+        # let the frame in progress finish so the panel isn't put to sleep mid-update
+        with self._cond:
+            self._running = False
+            self._full_pending = self._partial_pending = False
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not (self._full_pending or self._partial_pending):
+                    self._cond.wait()
+                if not self._running:
+                    return
+                # full refresh first, a screen change requested alongside it is drawn right after
+                full = self._full_pending
+                if full:
+                    self._full_pending = False
+                else:
+                    self._partial_pending = False
+                self._busy = True
+            start = time.monotonic()
+            try:
+                self.draw_fn(full)
+            except Exception as e:
+                print("Render error:", e)
+            finally:
+                self.last_frame_time = time.monotonic() - start
+                if not full:
+                    self.partial_time = 0.8 * self.partial_time + 0.2 * self.last_frame_time
+                self.frames += 1
+                with self._cond:
+                    self._busy = False
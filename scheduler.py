@@ -0,0 +1,74 @@
+# scheduler.py
+# deadline based wakeups for the main loop
+# instead of waking every 50ms the loop sleeps until the earliest thing that can happen (next minute, blink,
+# timeouts, snooze end, ...) and is woken early by notify() from the gpiozero callbacks
+
+import heapq
+import itertools
+import threading
+import time
+
+# wake a little after a deadline so the loop's own `>=` checks see it as due
+WAKE_SLACK = 0.005
+
+
+class Deadlines:
+    """
+    Named wall-clock deadlines (time.time() timestamps) kept in a heap.
+    set() replaces any earlier deadline with the same name, replaced entries are dropped lazily.
+    The loop sets most deadlines again on every pass, setting an unchanged time adds nothing to the heap,
+    and the heap is rebuilt once replaced entries outnumber the live ones.
+    """
+
+    def __init__(self):
+        self._heap   = []                # (when, seq, name)
+        self._active = {}                # name -> (when, seq) of the live entry
+        self._seq    = itertools.count()
+        self._lock   = threading.Lock()
+        self._wake   = threading.Event()
+        self.lag     = 0.0               # smoothed seconds the loop got back to a due deadline late
+
+    def set(self, name, when):
+        with self._lock:
+            live = self._active.get(name)
+            if live is not None and live[0] == when:
+                return
+            seq = next(self._seq)
+            self._active[name] = (when, seq)
+            heapq.heappush(self._heap, (when, seq, name))
+            if len(self._heap) > 2 * len(self._active) + 16:
+                self._heap = [(w, q, n) for n, (w, q) in self._active.items()]
+                heapq.heapify(self._heap)
+
+    def clear(self, name):
+        with self._lock:
+            self._active.pop(name, None)
+
+    def next(self):
+        """Return (when, name) of the earliest live deadline, or None."""
+        with self._lock:
+            while self._heap:
+                when, seq, name = self._heap[0]
+                live = self._active.get(name)
+                if live is not None and live[1] == seq:
+                    return when, name
+                heapq.heappop(self._heap)
+            return None
+
+    def notify(self):
+        # called from input callbacks: wake the loop right away
+        self._wake.set()
+
+    def wait(self, max_wait=None):
+        """Sleep until the earliest deadline, max_wait seconds or notify(), whichever comes first."""
+        head = self.next()
+        timeout = max_wait
+        if head is not None:
+            until = max(0.0, head[0] - time.time()) + WAKE_SLACK
+            timeout = until if timeout is None else min(timeout, until)
+        woken = self._wake.wait(timeout)
+        self._wake.clear()
+        now = time.time()
+        if head is not None and not woken and now >= head[0]:
+            # woke for the deadline: anything past the slack means a busy cpu or a loop that was behind
+            self.lag = 0.8 * self.lag + 0.2 * max(0.0, now - head[0] - WAKE_SLACK)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# shelly_sim.py
+# local stand-in for a shelly bulb so light_control can be tried and benchmarked without one
+# serves the gen1 http api (/light/0, /settings/light/0) and the json-rpc websocket (/rpc) on top of one
+# shared bulb state, so both transports in light_transport.py can be pointed at it.
+# over rpc it looks like a gen2+ device with an rgb:0 (colour mode) and a cct:0 (white mode) component
+# Faults adds what a real bulb on wifi does: latency, jitter, dropped requests and rate limiting
+# usage: python3 shelly_sim.py [--latency 0.05 --jitter 0.02 --drop 0.05 --rate-limit 10]
+#        then use SHELLY_IPS = ["127.0.0.1:<port>"] (or light_control.configure)
+
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from light_transport import accept_key, recv_frame, send_frame
+
+INT_KEYS = ("brightness", "temp", "red", "green", "blue", "transition")
+
+
+class FakeShelly:
+    """Bulb state in the gen1 status shape, shared by the http and websocket servers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = {"ison": False, "mode": "white", "brightness": 15, "temp": 3000,
+                       "red": 255, "green": 20, "blue": 2, "transition": 0}
+        self.requests = 0        # everything that got an answer, status polls included
+        self.commands = 0        # requests that carried parameters
+        self.log = []            # (time.monotonic(), params) of every command
+
+    def apply(self, params):
+        """Apply gen1 query parameters and return the status afterwards."""
+        with self.lock:
+            self.requests += 1
+            if params:
+                self.commands += 1
+                for key, value in params.items():
+                    if key == "turn":
+                        self.status["ison"] = value == "on"
+                    elif key in INT_KEYS:
+                        self.status[key] = int(value)
+                    elif key == "mode":
+                        self.status["mode"] = value
+                self.log.append((time.monotonic(), dict(params)))
+            return dict(self.status)
+
+    def settings(self):
+        with self.lock:
+            return {"transition": self.status["transition"]}
+
+
+class Faults:
+    """
+    Misbehaviour applied to every request before it is answered: latency +- jitter seconds,
+    a `drop` chance of never answering (the connection is closed after drop_hang seconds, long enough
+    for the client to time out), and a token bucket of rate_limit requests per second, over which
+    requests are refused straight away like a flooded shelly does.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, drop=0.0, rate_limit=None, drop_hang=3.0, seed=None):
+        self.latency    = latency
+        self.jitter     = jitter
+        self.drop       = drop
+        self.rate_limit = rate_limit
+        self.drop_hang  = drop_hang
+        self.rng    = random.Random(seed)
+        self.lock   = threading.Lock()
+        self.tokens = rate_limit or 0
+        self.refilled = time.monotonic()
+        # counters
+        self.dropped = 0
+        self.limited = 0
+
+    def decide(self):
+        """Sleep the latency, then return None (answer), "drop" or "limit"."""
+        with self.lock:
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            dropped = self.rng.random() < self.drop
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            if dropped:
+                self.dropped += 1
+                return "drop"
+            if self.rate_limit:
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit)
+                self.refilled = now
+                if self.tokens < 1:
+                    self.limited += 1
+                    return "limit"
+                self.tokens -= 1
+        return None
+
+
+# --- gen1 http -------------------------------------------------------------------
+
+class HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive, like the real bulb
+    disable_nagle_algorithm = True    # headers and body go out as separate writes
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        bulb = self.server.bulb
+        fault = self.server.faults.decide()
+        if fault == "drop":
+            time.sleep(self.server.faults.drop_hang)
+            self.close_connection = True
+            return
+        if fault == "limit":
+            self._reply(429, {"error": "too many requests"})
+            return
+        if url.path == "/light/0":
+            self._reply(200, bulb.apply(dict(parse_qsl(url.query))))
+        elif url.path == "/settings/light/0":
+            self._reply(200, bulb.settings())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _reply(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# --- json-rpc websocket ----------------------------------------------------------
+
+def rpc_to_query(kind, args):
+    # <Type>.Set arguments -> gen1 query, the inverse of light_transport.to_rpc
+    query = {"mode": "color" if kind == "rgb" else "white"}
+    if "on" in args:
+        query["turn"] = "on" if args["on"] else "off"
+    if "brightness" in args:
+        query["brightness"] = args["brightness"]
+    if "ct" in args:
+        query["temp"] = args["ct"]
+    if "rgb" in args:
+        query["red"], query["green"], query["blue"] = args["rgb"]
+    if "transition_duration" in args:
+        query["transition"] = int(args["transition_duration"] * 1000)
+    return query
+
+
+def status_to_rpc(status):
+    # gen1 status -> Shelly.GetStatus, only the component of the current mode can be on
+    on = status["ison"]
+    return {
+        "rgb:0": {"id": 0, "output": on and status["mode"] == "color", "brightness": status["brightness"],
+                  "rgb": [status["red"], status["green"], status["blue"]]},
+        "cct:0": {"id": 0, "output": on and status["mode"] == "white", "brightness": status["brightness"],
+                  "ct": status["temp"]},
+    }
+
+
+RPC_KINDS = {"RGB": "rgb", "CCT": "cct"}
+
+
+class WsHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = sock.recv(1024)
+            if not chunk:
+                return
+            head += chunk
+        headers = {}
+        for line in head.decode(errors="replace").split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            sock.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return
+        sock.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+        ).encode())
+        bulb = self.server.bulb
+        while True:
+            try:
+                opcode, payload = recv_frame(sock)
+            except (ConnectionError, OSError):
+                return
+            if opcode == 0x8:
+                return
+            if opcode == 0x9:
+                send_frame(sock, payload, opcode=0xA, mask=False)
+                continue
+            msg = json.loads(payload)
+            method, args = msg.get("method"), msg.get("params") or {}
+            fault = self.server.faults.decide()
+            if fault == "drop":
+                time.sleep(self.server.faults.drop_hang)
+                return
+            if fault == "limit":
+                reply = {"id": msg.get("id"), "error": {"code": 429, "message": "too many requests"}}
+                send_frame(sock, json.dumps(reply).encode(), mask=False)
+                continue
+            namespace, _, action = method.partition(".")
+            kind = RPC_KINDS.get(namespace)
+            if method == "Shelly.GetStatus":
+                result = status_to_rpc(bulb.apply(None))
+            elif kind and action == "Set":
+                with bulb.lock:
+                    other_mode = bulb.status["mode"] != ("color" if kind == "rgb" else "white")
+                if args.get("on") is False and other_mode:
+                    # switching off the component that isn't lit, the other one must stay on
+                    bulb.apply(None)
+                else:
+                    bulb.apply(rpc_to_query(kind, args))
+                result = None
+            elif kind and action == "GetStatus":
+                result = status_to_rpc(bulb.apply(None))[f"{kind}:0"]
+            else:
+                reply = {"id": msg.get("id"), "error": {"code": 404, "message": f"no method {method}"}}
+                send_frame(sock, json.dumps(reply).encode(), mask=False)
+                continue
+            send_frame(sock, json.dumps({"id": msg.get("id"), "result": result}).encode(), mask=False)
+
+
+class WsServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(http_port=0, ws_port=0, bulb=None, faults=None):
+    """Start both servers on background threads. Returns (bulb, http_address, ws_address) as "host:port"."""
+    bulb = bulb or FakeShelly()
+    faults = faults or Faults()
+    http = ThreadingHTTPServer(("127.0.0.1", http_port), HttpHandler)
+    http.daemon_threads = True
+    ws = WsServer(("127.0.0.1", ws_port), WsHandler)
+    for server in (http, ws):
+        server.bulb = bulb
+        server.faults = faults
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return bulb, "%s:%d" % http.server_address, "%s:%d" % ws.server_address
+
+
+def add_fault_args(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds of random latency")
+    parser.add_argument("--drop", type=float, default=0.0, help="chance (0..1) a request is never answered")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before refusing")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def faults_from_args(args):
+    return Faults(args.latency, args.jitter, args.drop, args.rate_limit, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fake shelly bulb")
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--ws-port", type=int, default=8081)
+    add_fault_args(parser)
+    args = parser.parse_args()
+    bulb, http_addr, ws_addr = start(args.http_port, args.ws_port, faults=faults_from_args(args))
+    print(f"fake shelly: http {http_addr}, websocket {ws_addr}/rpc")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
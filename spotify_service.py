@@ -1,23 +1,68 @@
 from pathlib import Path
 import shutil
-import subprocess
 import threading
 import logging
 import json
+import time
 import concurrent.futures
+import requests
 from spotipy import Spotify
 from auth import get_auth
+from storage import atomic_write_json
+from download_backends import make_backend
+from download_queue import DownloadQueue, DONE
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+API_URL = "https://api.spotify.com/v1"
+# the cached playlist list is shown right away, and refreshed in the background once it is older than this
+CATALOG_TTL = 300
+# largest pages the api hands out for each listing
+PLAYLIST_PAGE = 50
+TRACK_PAGE = 100
+# listing pages fetched at the same time once the first page has told us the total
+PAGE_WORKERS = 4
+# times a request is repeated after a 429, waiting as long as spotify's Retry-After asks
+API_RETRIES = 3
+# "ytdlp" runs yt-dlp in this process and reuses it for every track, "subprocess" starts one per track
+DOWNLOAD_BACKEND = "ytdlp"
+# upper bound for parallel track downloads, the actual number is tuned while downloading (download_pool.py)
+MAX_DOWNLOAD_WORKERS = 4
+
+def _slim_playlist(p: dict) -> dict | None:
+    # everything the menu and the sync need, the full api objects are several kB each
+    if not p:
+        return None
+    return {"id": p["id"], "name": p.get("name") or "", "snapshot_id": p.get("snapshot_id")}
+
+def _slim_track(item: dict) -> dict | None:
+    t = (item or {}).get("track") or {}
+    tid = t.get("id")
+    title = t.get("name")
+    artists = t.get("artists") or []
+    artist = artists[0]["name"] if artists else ""
+    if tid and title:
+        return {"id": tid, "title": title, "artist": artist}
+    return None
+
+def _track_stem(artist: str, title: str, tid: str | None = None) -> str:
+    # file name (without extension) of a track. a "/" (AC/DC) would make yt-dlp write into a subfolder
+    # where the manifest, which stores plain file names, never finds it again. the track id keeps two
+    # tracks with the same artist and title apart, files from before it was added are named without it
+    stem = f"{artist} - {title}" if tid is None else f"{artist} - {title} [{tid}]"
+    return stem.replace("/", "_").replace("\\", "_")
+
+def _join_pages(pages: dict) -> list:
+    return [item for off in sorted(pages, key=int) for item in pages[off]["items"]]
+
 class SpotifyService:
     """
     Service to list and download Spotify playlists using yt-dlp for reliable track fetching.
     Now includes management of recent (downloaded) playlists and automatic pruning.
     """
-    def __init__(self, music_dir: Path | str = None, recent_limit: int = 3):
+    def __init__(self, music_dir: Path | str = None, recent_limit: int = 3, backend=None):
         logger.debug("Initializing SpotifyService")
         self.sp = Spotify(
             auth_manager=get_auth(),
@@ -31,29 +76,165 @@ class SpotifyService:
         self.music_dir = Path(music_dir or "/data/Music/alarm_tracks")
         self.music_dir.mkdir(parents=True, exist_ok=True)
         self.recent_limit = recent_limit
+        # yt-dlp instances live as long as the service, so their setup is paid once
+        self.backend = backend or make_backend(DOWNLOAD_BACKEND)
+        # optional callable returning a reason when the ui is struggling, downloads then back off
+        self.ui_pressure = None
+        # track downloads go through a queue on disk, so they resume after a reboot (resume_downloads)
+        self.queue = DownloadQueue(
+            self.music_dir / "download_queue.json", self._download_track,
+            on_finished=self._sync_finished, ui_pressure=self._ui_pressure, max_workers=MAX_DOWNLOAD_WORKERS,
+        )
+        self._manifest_lock = threading.Lock()
+        # throttled "download progress changed" signal for the display (download_queue.ProgressChannel)
+        self.download_updates = self.queue.updates
         self.recent_file = self.music_dir / "recent_playlists.json"
-        self.playlists: list[dict] = []
+        # playlist catalog: shown from disk, refreshed in the background with conditional requests
+        self.catalog_file = self.music_dir / "playlists.json"
+        self.catalog = self._load_catalog()
+        self.playlists: list[dict] = self.catalog["playlists"]
+        self.session = requests.Session()
+        self._catalog_lock = threading.Lock()
+        self._refreshing = False
         self.selected_index = 0
+        self._retry_after = 0.0           # monotonic time before which no request goes out (429)
         # Load or init recent list
         self.recent_playlists = self._load_recent()
 
-    def _load_playlists(self) -> None:
+    # --- Playlist catalog ---
+    def _load_catalog(self) -> dict:
+        empty = {"fetched": 0, "pages": {}, "playlists": []}
+        if self.catalog_file.exists():
+            try:
+                with open(self.catalog_file) as f:
+                    return {**empty, **json.load(f)}
+            except Exception as e:
+                logger.warning(f"Could not load playlist catalog: {e}")
+        return empty
+
+    def _api_get(self, path: str, params: dict = None, etag: str = None):
+        """
+        GET a Web API endpoint with the spotipy token. With an etag the request is conditional.
+        Returns (etag, json), json is None when spotify answered 304 Not Modified.
+        """
+        token = self.sp.auth_manager.get_access_token(as_dict=False)
+        headers = {"Authorization": f"Bearer {token}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        for attempt in range(API_RETRIES + 1):
+            # a 429 on any thread holds back all of them, parallel paging would just hit it again
+            wait = self._retry_after - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            resp = self.session.get(API_URL + path, params=params, headers=headers, timeout=5)
+            if resp.status_code != 429 or attempt == API_RETRIES:
+                break
+            delay = float(resp.headers.get("Retry-After", 1))
+            logger.warning(f"[Spotify] Rate limited, retrying in {delay:.0f}s")
+            self._retry_after = max(self._retry_after, time.monotonic() + delay)
+        if resp.status_code == 304:
+            return etag, None
+        resp.raise_for_status()
+        return resp.headers.get("ETag"), resp.json()
+
+    def _fetch_page(self, path: str, offset: int, limit: int, slim, cached: dict | None = None,
+                    params: dict = None) -> dict:
+        # one listing page as {"etag", "total", "items"}, reused from the cache when spotify says it's unchanged
+        etag, data = self._api_get(path, {**(params or {}), "limit": limit, "offset": offset},
+                                   cached and cached.get("etag"))
+        if data is None:
+            return cached
+        items = (slim(item) for item in data.get("items", []))
+        return {"etag": etag, "total": data.get("total", 0), "items": [item for item in items if item]}
+
+    def _fetch_pages(self, path: str, limit: int, slim, cached_pages: dict = None, params: dict = None) -> dict:
+        """
+        Fetch a whole offset-paged listing as {offset: page}. The first page tells the total, the other
+        offsets are then fetched PAGE_WORKERS at a time instead of following `next` links one by one.
+        """
+        cached_pages = cached_pages or {}
+
+        def fetch(offset):
+            return self._fetch_page(path, offset, limit, slim, cached_pages.get(str(offset)), params)
+
+        first = fetch(0)
+        pages = {"0": first}
+        offsets = range(limit, first["total"], limit)
+        if offsets:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=PAGE_WORKERS) as pool:
+                # map keeps the offsets in order and raises the first error
+                for offset, page in zip(offsets, pool.map(fetch, offsets)):
+                    pages[str(offset)] = page
+        return pages
+
+    def _load_playlists(self) -> set[str]:
+        """
+        Fetch the playlist catalog from spotify and save it.
+        Returns the ids of the playlists that were added, removed or got a new snapshot_id since the
+        previous catalog, empty if nothing changed.
+        """
         logger.debug("Fetching playlists from Spotify API")
         try:
-            resp = self.sp.current_user_playlists(limit=50)
-            self.playlists = resp.get("items", [])
-            while resp.get("next"):
-                resp = self.sp.next(resp)
-                self.playlists.extend(resp.get("items", []))
-            logger.debug(f"Loaded {len(self.playlists)} playlists")
+            pages = self._fetch_pages("/me/playlists", PLAYLIST_PAGE, _slim_playlist, self.catalog.get("pages"))
         except Exception as e:
             logger.error(f"[Spotify] Failed to load playlists: {e}")
             raise
-    def enter_playlist_menu(self) -> list[tuple[str, str]]:
+        playlists = _join_pages(pages)
+        changed = {p["id"] for p in playlists} ^ {p["id"] for p in self.playlists} | {
+            p["id"] for p in playlists if p.get("snapshot_id") != self.snapshot_id(p["id"])}
+        with self._catalog_lock:
+            self.playlists = playlists
+            self.catalog = {"fetched": time.time(), "pages": pages, "playlists": playlists}
+        try:
+            atomic_write_json(self.catalog_file, self.catalog)
+        except OSError as e:
+            logger.warning(f"Could not save playlist catalog: {e}")
+        logger.debug(f"Loaded {len(self.playlists)} playlists, {len(changed)} new or changed")
+        return changed
+
+    def snapshot_id(self, pid: str) -> str | None:
+        """Spotify's version tag of the playlist as of the last catalog refresh."""
+        for p in self.playlists:
+            if p["id"] == pid:
+                return p.get("snapshot_id")
+        return None
+
+    def catalog_age(self) -> float:
+        return time.time() - self.catalog.get("fetched", 0)
+
+    def refresh_catalog(self, on_update=None, on_error=None, force: bool = False) -> bool:
+        """
+        Refresh the playlist catalog on a background thread if it is older than CATALOG_TTL (or force).
+        on_update(pairs) is called when the list changed, on_error(exc) when spotify couldn't be reached.
+        Returns True if a refresh was started.
+        """
+        with self._catalog_lock:
+            if self._refreshing or (not force and self.playlists and self.catalog_age() < CATALOG_TTL):
+                return False
+            self._refreshing = True
+
+        def _worker():
+            try:
+                changed = self._load_playlists()
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+                return
+            finally:
+                with self._catalog_lock:
+                    self._refreshing = False
+            if changed and on_update:
+                on_update(self.list_playlists())
+
+        threading.Thread(target=_worker, daemon=True).start()
+        return True
+
+    def enter_playlist_menu(self, on_update=None, on_error=None) -> list[tuple[str, str]]:
         """
-        Refresh the playlist cache when entering selection menu.
+        Return the cached playlists right away (empty on the very first run) and refresh them in the
+        background when they are stale, see refresh_catalog.
         """
-        self._load_playlists()
+        self.refresh_catalog(on_update, on_error)
         return self.list_playlists()
 
     def list_playlists(self) -> list[tuple[str, str]]:
@@ -76,8 +257,54 @@ class SpotifyService:
         """
         Return True if any tracks for this playlist are already downloaded.
         """
+        return bool(self.playable_tracks(pid))
+
+    def playable_tracks(self, pid: str) -> list[Path]:
+        """
+        Sorted .wav files of this playlist that are completely downloaded. While the playlist is still
+        downloading these are the tracks finished so far, files being written are never included.
+        """
         folder = self.music_dir / pid
-        return folder.exists() and any(folder.glob("*.wav"))
+        with self._manifest_lock:
+            manifest = self._load_manifest(pid)
+        if manifest["tracks"]:
+            return sorted(p for p in (folder / f for f in manifest["tracks"].values()) if p.exists())
+        # folders downloaded before manifests existed
+        return sorted(folder.glob("*.wav")) if folder.exists() else []
+
+    def is_synced(self, pid: str) -> bool:
+        """
+        Return True if the local copy matches the playlist as of the last catalog refresh,
+        i.e. selecting it again has nothing to download or delete.
+        """
+        snapshot = self.snapshot_id(pid)
+        manifest = self._load_manifest(pid)
+        folder = self.music_dir / pid
+        return (snapshot is not None and manifest["snapshot_id"] == snapshot
+                and all((folder / f).exists() for f in manifest["tracks"].values()))
+
+    # --- Per playlist manifest ---
+    # <music_dir>/<pid>/manifest.json: {"snapshot_id": ..., "tracks": {spotify track id: file name}}
+    # snapshot_id is only written once every track of that snapshot is on disk
+    def _manifest_file(self, pid: str) -> Path:
+        return self.music_dir / pid / "manifest.json"
+
+    def _load_manifest(self, pid: str) -> dict:
+        path = self._manifest_file(pid)
+        if path.exists():
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                return {"snapshot_id": data.get("snapshot_id"), "tracks": dict(data.get("tracks", {}))}
+            except Exception as e:
+                logger.warning(f"Could not load manifest of {pid}: {e}")
+        return {"snapshot_id": None, "tracks": {}}
+
+    def _save_manifest(self, pid: str, manifest: dict):
+        try:
+            atomic_write_json(self._manifest_file(pid), manifest)
+        except OSError as e:
+            logger.warning(f"Could not save manifest of {pid}: {e}")
 
     # --- Recent playlists cache ---
     def _load_recent(self):
@@ -110,96 +337,124 @@ class SpotifyService:
         self._save_recent()
 
     # --- Downloading and deleting ---
-    def download_playlist(self, pid: str, name: str) -> threading.Thread:
+    def download_playlist(self, pid: str, name: str) -> None:
         """
-        Download all tracks in the given playlist via yt-dlp.
+        Sync the given playlist to disk via yt-dlp: only tracks that aren't downloaded yet are fetched,
+        tracks removed from the playlist are deleted, and nothing happens if its snapshot is unchanged.
         Uses ytsearch1 to fetch the top YouTube Music result for each track.
+        Runs in the background, download_progress(pid) tells how far it got (None once it's over).
         Also tracks download in recent_playlists, and removes old playlists if over limit.
         """
+        if not self.queue.add(pid, name):
+            logger.debug(f"Playlist '{name}' is already being downloaded")
+            return
+        threading.Thread(target=self._list_missing, args=(pid, name), daemon=True).start()
+
+    def resume_downloads(self):
+        """Pick up the downloads that were queued when the program last stopped."""
+        for pid, name, listed in self.queue.queued():
+            logger.info(f"Resuming download of playlist '{name}'")
+            if not listed:
+                threading.Thread(target=self._list_missing, args=(pid, name), daemon=True).start()
+        self.queue.start()
+
+    def download_progress(self, pid: str) -> dict | None:
+        return self.queue.progress(pid)
+
+    def cancel_download(self, pid: str):
+        """Stop downloading a playlist. Tracks that are already complete are kept for the next sync."""
+        self.queue.cancel(pid)
+
+    def _ui_pressure(self):
+        return self.ui_pressure() if self.ui_pressure is not None else None
+
+    def _list_missing(self, pid: str, name: str):
+        # first half of a sync: work out which tracks have to be downloaded and queue them
+        logger.debug(f"Starting sync for playlist: {name} ({pid})")
         final_dir = self.music_dir / pid
         final_dir.mkdir(parents=True, exist_ok=True)
+        snapshot = self.snapshot_id(pid)
+        if self.is_synced(pid):
+            logger.info(f"Playlist '{name}' unchanged since the last sync")
+            self.queue.drop(pid)
+            self.update_recent(pid)
+            return
 
-        def _worker():
-            logger.debug(f"Starting download for playlist: {name} ({pid})")
-            # Fetch track metadata (id, title, artist)
-            try:
-                resp = self.sp.playlist_items(
-                    pid,
-                    fields="items(track(id,name,artists(name))),next",
-                    limit=5
-                )
-            except Exception as e:
-                logger.error(f"[Spotify] Failed to list playlist items: {e}")
-                return  # exits thread; UI will see not-downloaded and fall back
+        # Fetch track metadata (id, title, artist)
+        try:
+            pages = self._fetch_pages(
+                f"/playlists/{pid}/tracks", TRACK_PAGE, _slim_track,
+                params={"fields": "items(track(id,name,artists(name))),total"},
+            )
+            tracks = _join_pages(pages)
+            logger.debug(f"Found {len(tracks)} tracks in playlist '{name}'")
+        except Exception as e:
+            logger.error(f"[Spotify] Failed to list playlist items: {e}")
+            self.queue.drop(pid)
+            return  # UI will see not-downloaded and fall back
 
-            tracks = []
-            try:
-                for item in resp.get("items", [])[:5]:
-                    t = item.get("track") or {}
-                    tid = t.get("id")
-                    title = t.get("name")
-                    artists = t.get("artists") or []
-                    artist = artists[0]["name"] if artists else ""
-                    if tid and title:
-                        tracks.append({"id": tid, "title": title, "artist": artist})
-                while resp.get("next"):
-                    resp = self.sp.next(resp)
-                    for item in resp.get("items", []):
-                        t = item.get("track") or {}
-                        tid = t.get("id")
-                        title = t.get("name")
-                        artists = t.get("artists") or []
-                        artist = artists[0]["name"] if artists else ""
-                        if tid and title:
-                            tracks.append({"id": tid, "title": title, "artist": artist})
-                logger.debug(f"Found {len(tracks)} tracks in playlist '{name}'")
-            except Exception as e:
-                logger.error(f"[Spotify] Error while paging playlist items: {e}")
-                return
+        with self._manifest_lock:
+            manifest = self._load_manifest(pid)
+            files = manifest["tracks"]
+            wanted = {t["id"] for t in tracks}
 
-            def fetch_one(tr):
-                artist = tr["artist"]
-                title  = tr["title"]
-                query  = f"{artist} - {title} official audio"
-                outfile = final_dir / f"{artist} - {title}.m4a"
-
-                cmd = [
-                    "yt-dlp",
-                    "--default-search", "ytsearch1",
-                    "-f", "bestaudio[ext=m4a]/bestaudio",
-                    "-x", "--audio-format", "wav",
-                    "-o", str(outfile),
-                    query,
-                ]
-
-                # Run and capture everything—nothing will print to your console/display
-                result = subprocess.run(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                )
-
-                if result.returncode != 0:
-                    # Log the error so you can inspect it in your logs, but don't dump to screen
-                    logger.error(
-                        f"Failed to download [{artist} - {title}]: "
-                        f"{result.stderr.strip().splitlines()[-1]}"
-                    )
-                else:
-                    logger.debug(f"Downloaded: {artist} - {title}")
-
-            # Parallelize up to 4 downloads at once
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
-                pool.map(fetch_one, tracks)
-
-            logger.info(f"Completed download for playlist: {name}")
-            # Update recents and prune old
-            self.update_recent(pid)
+            # delete tracks that were removed from the playlist
+            removed = [tid for tid in files if tid not in wanted]
+            dropped = {files.pop(tid) for tid in removed}
+            # two track ids with the same artist and title share a file, keep it while one of them is left
+            for fname in dropped - set(files.values()):
+                path = final_dir / fname
+                logger.info(f"Removing track no longer in playlist: {path.name}")
+                path.unlink(missing_ok=True)
+
+            missing = []
+            for tr in tracks:
+                if tr["id"] in files and (final_dir / files[tr["id"]]).exists():
+                    continue
+                # adopt files downloaded before manifests existed instead of fetching them again
+                legacy = final_dir / f"{_track_stem(tr['artist'], tr['title'])}.wav"
+                if legacy.exists():
+                    files[tr["id"]] = legacy.name
+                    continue
+                missing.append(tr)
+            manifest["snapshot_id"] = None   # set again once every track is here
+            self._save_manifest(pid, manifest)
+        logger.debug(f"Playlist '{name}': {len(missing)} to download, {len(removed)} removed")
+        self.queue.set_jobs(pid, snapshot, missing)
+
+    def _download_track(self, pid: str, job: dict, cancel: threading.Event, progress=None) -> int:
+        # one queue job, returns the size of the new file for the throughput measurement
+        final_dir = self.music_dir / pid
+        with self._manifest_lock:
+            done = self._load_manifest(pid)["tracks"].get(job["id"])
+        if done and (final_dir / done).exists():
+            return 0   # finished before a crash, but the queue never heard about it
+
+        artist = job["artist"]
+        title  = job["title"]
+        query  = f"{artist} - {title} official audio"
+        outfile = final_dir / f"{_track_stem(artist, title, job['id'])}.m4a"
+        final_dir.mkdir(parents=True, exist_ok=True)
+        wav = self.backend.download(query, outfile, cancel=cancel, progress=progress)
+        logger.debug(f"Downloaded: {artist} - {title}")
+        with self._manifest_lock:
+            manifest = self._load_manifest(pid)
+            manifest["tracks"][job["id"]] = wav.name
+            self._save_manifest(pid, manifest)
+        return wav.stat().st_size
 
-        thread = threading.Thread(target=_worker, daemon=True)
-        thread.start()
-        return thread
+    def _sync_finished(self, pid: str, entry: dict):
+        # second half of a sync, called by the queue once every job ran
+        complete = all(job["state"] == DONE for job in entry["jobs"])
+        with self._manifest_lock:
+            manifest = self._load_manifest(pid)
+            if complete:
+                manifest["snapshot_id"] = entry["snapshot"]
+            self._save_manifest(pid, manifest)
+        logger.info(f"Completed sync for playlist: {entry['name']}"
+                    + ("" if complete else " (some tracks failed)"))
+        # Update recents and prune old
+        self.update_recent(pid)
 
     def get_local_tracks(self, pid: str = None) -> list[Path]:
         """
@@ -214,6 +469,7 @@ class SpotifyService:
         """
         Delete all downloaded tracks for the given playlist ID.
         """
+        self.queue.cancel(pid)
         folder = self.music_dir / pid
         if folder.exists():
             shutil.rmtree(folder, ignore_errors=True)
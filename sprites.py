@@ -0,0 +1,190 @@
+# sprites.py
+# pre-rendered glyph and icon tiles for the clock screens
+# rasterising the 120pt clock font is by far the most expensive part of drawing a frame on the pi zero,
+# so the digits, the date font and the icons are rendered once, cached on disk and then just pasted together
+
+import hashlib
+import json
+import os
+import string
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+# bump this when the tile layout or the cache format changes so old caches get rebuilt
+ATLAS_VERSION = 1
+CACHE_DIR = "/data/app/sprite_cache"
+
+TIME_CHARS = "0123456789:"
+DATE_CHARS = string.ascii_letters + string.digits + string.punctuation + " "
+
+
+class Glyph:
+    """One pre-rendered character: ink mask, offset from the pen position and advance width."""
+    __slots__ = ("mask", "left", "top", "advance")
+
+    def __init__(self, mask, left, top, advance):
+        self.mask    = mask      # mode '1' image, 1 = ink (None for blank glyphs like space)
+        self.left    = left
+        self.top     = top
+        self.advance = advance
+
+
+class GlyphSet:
+    """Tiles for one font. bbox() and draw() mirror draw.textbbox() and draw.text() for the cached characters."""
+
+    def __init__(self, font, glyphs):
+        self.font   = font
+        self.glyphs = glyphs
+
+    def _layout(self, text):
+        pen = 0.0
+        for ch in text:
+            g = self.glyphs[ch]
+            yield round(pen), g
+            pen += g.advance
+
+    def covers(self, text):
+        return all(ch in self.glyphs for ch in text)
+
+    def bbox(self, text, xy=(0, 0)):
+        if not self.covers(text):
+            # characters outside the atlas fall back to the real font
+            return ImageDraw.Draw(Image.new('1', (1, 1))).textbbox(xy, text, font=self.font)
+        x, y = xy
+        left = top = right = bottom = None
+        for px, g in self._layout(text):
+            if g.mask is None:
+                continue
+            l, t = x + px + g.left, y + g.top
+            r, b = l + g.mask.width, t + g.mask.height
+            left   = l if left   is None else min(left, l)
+            top    = t if top    is None else min(top, t)
+            right  = r if right  is None else max(right, r)
+            bottom = b if bottom is None else max(bottom, b)
+        if left is None:
+            return (x, y, x, y)
+        return (left, top, right, bottom)
+
+    def draw(self, img, xy, text, fill=0):
+        if not self.covers(text):
+            ImageDraw.Draw(img).text(xy, text, font=self.font, fill=fill)
+            return
+        x, y = xy
+        for px, g in self._layout(text):
+            if g.mask is not None:
+                img.paste(fill, (x + px + g.left, y + g.top), g.mask)
+
+
+class SpriteAtlas:
+    """
+    Glyph sets and icons rendered once and kept in memory.
+    The tiles are stored as one png strip plus a json index in CACHE_DIR, keyed by fonts, sizes and charsets,
+    so later startups only need to decode a single small image.
+    """
+
+    def __init__(self, fonts, icons, cache_dir=CACHE_DIR):
+        # fonts: {name: (FreeTypeFont, charset)}, icons: {name: function returning a mode '1' image}
+        self.fonts     = fonts
+        self.icon_fns  = icons
+        self.cache_dir = Path(cache_dir)
+        self.glyphs    = {}
+        self.icons     = {}
+
+        key = self._cache_key()
+        sheet_path = self.cache_dir / f"{key}.png"
+        index_path = self.cache_dir / f"{key}.json"
+        if not self._load(sheet_path, index_path):
+            self._build()
+            self._save(sheet_path, index_path)
+
+    def _cache_key(self):
+        h = hashlib.sha1()
+        h.update(str(ATLAS_VERSION).encode())
+        for name in sorted(self.fonts):
+            font, charset = self.fonts[name]
+            h.update(f"{name}|{font.path}|{font.size}|{charset}".encode())
+        for name in sorted(self.icon_fns):
+            h.update(name.encode())
+            h.update(self.icon_fns[name]().tobytes())
+        return h.hexdigest()[:16]
+
+    # --- building ------------------------------------------------------------
+
+    def _build(self):
+        for name, (font, charset) in self.fonts.items():
+            glyphs = {}
+            for ch in charset:
+                l, t, r, b = font.getbbox(ch)
+                mask = None
+                if r > l and b > t:
+                    mask = Image.new('1', (r - l, b - t), 0)
+                    ImageDraw.Draw(mask).text((-l, -t), ch, font=font, fill=1)
+                    if mask.getbbox() is None:
+                        mask = None
+                glyphs[ch] = Glyph(mask, l, t, font.getlength(ch))
+            self.glyphs[name] = GlyphSet(font, glyphs)
+        for name, fn in self.icon_fns.items():
+            self.icons[name] = fn()
+
+    # --- disk cache ----------------------------------------------------------
+
+    def _tiles(self):
+        for name, gs in self.glyphs.items():
+            for ch, g in gs.glyphs.items():
+                yield "glyph", name, ch, g, g.mask
+        for name, icon in self.icons.items():
+            yield "icon", name, "", None, icon
+
+    def _save(self, sheet_path, index_path):
+        tiles = list(self._tiles())
+        width  = sum(t[4].width for t in tiles if t[4] is not None) or 1
+        height = max((t[4].height for t in tiles if t[4] is not None), default=1)
+        sheet = Image.new('1', (width, height), 0)
+        index = {"glyphs": {}, "icons": {}}
+        x = 0
+        for kind, name, ch, g, tile in tiles:
+            box = None
+            if tile is not None:
+                sheet.paste(tile, (x, 0))
+                box = [x, 0, tile.width, tile.height]
+                x += tile.width
+            if kind == "glyph":
+                index["glyphs"].setdefault(name, {})[ch] = [box, g.left, g.top, g.advance]
+            else:
+                index["icons"][name] = box
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            sheet.save(sheet_path)
+            with open(index_path, "w") as f:
+                json.dump(index, f)
+        except Exception as e:
+            print("Failed to save sprite cache:", e)
+
+    def _load(self, sheet_path, index_path):
+        if not (os.path.exists(sheet_path) and os.path.exists(index_path)):
+            return False
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            sheet = Image.open(sheet_path).convert('1')
+
+            def crop(box):
+                if box is None:
+                    return None
+                x, y, w, h = box
+                return sheet.crop((x, y, x + w, y + h))
+
+            glyphs = {}
+            for name, (font, charset) in self.fonts.items():
+                entries = index["glyphs"][name]
+                glyphs[name] = GlyphSet(font, {
+                    ch: Glyph(crop(box), left, top, advance)
+                    for ch, (box, left, top, advance) in entries.items()
+                })
+            icons = {name: crop(index["icons"][name]) for name in self.icon_fns}
+        except Exception as e:
+            print("Failed to load sprite cache, rebuilding:", e)
+            return False
+        self.glyphs, self.icons = glyphs, icons
+        return True
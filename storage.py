@@ -0,0 +1,93 @@
+# storage.py
+# settings writes that are kind to the sd card
+# files are replaced atomically (temp file + fsync + rename) so a power cut never leaves a half written file,
+# and DebouncedWriter batches quick successive changes (encoder turns) into a single write
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write_json(path, data):
+    """Write data as json to path so that readers see either the old or the new file, never a partial one."""
+    path = os.fspath(path)
+    folder = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # make the rename itself durable
+    try:
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class DebouncedWriter:
+    """
+    Writes snapshot() to path in a background thread once changes have been quiet for `delay` seconds,
+    or at the latest `max_delay` seconds after the first unsaved change. flush() writes right away.
+    """
+
+    def __init__(self, path, snapshot, delay=2.0, max_delay=10.0):
+        self.path      = path
+        self.snapshot  = snapshot
+        self.delay     = delay
+        self.max_delay = max_delay
+        self._cond        = threading.Condition()
+        self._write_lock  = threading.Lock()
+        self._dirty_since = None
+        self._last_change = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        with self._cond:
+            now = time.monotonic()
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_change = now
+            self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            if self._dirty_since is None:
+                return
+            self._dirty_since = None
+            self._last_change = None
+        self._write()
+
+    def _write(self):
+        with self._write_lock:
+            try:
+                atomic_write_json(self.path, self.snapshot())
+            except Exception as e:
+                print(f"Failed to write {self.path}:", e)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._dirty_since is None:
+                    self._cond.wait()
+                due = min(self._last_change + self.delay, self._dirty_since + self.max_delay)
+                wait = due - time.monotonic()
+                if wait > 0:
+                    # woken early by another change, work the deadline out again
+                    self._cond.wait(wait)
+                    continue
+            self.flush()